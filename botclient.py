@@ -0,0 +1,551 @@
+# -*- coding: utf-8 -*-
+# pyright: reportMissingImports=false
+# pyright: reportMissingModuleSource=false
+#
+#   botclient - botserver client library for front-ends
+#
+# @see:
+#       clientConfiguration()       Client configuration (host, port, certificates) and TLS context, shared with botctl
+#       botClient()                 Thread safe pool of persistent mutual TLS connections, framed protocol
+#           .send(username, message)        Reply to [message] sent as [username]
+#           .command('sys,status')          Reply to a raw command
+#           .sendMany([(username, message), ...])   Replies in the same order, pipelined on every pool connection
+#           .close()
+#       asyncBotClient()            Same interface for asyncio front-ends, every method is a coroutine
+#
+#       Connections are opened on first use (at most [size]), kept alive with 'sys,ping' when idle and reopened
+#       with exponential backoff when lost. Sync pool reconnections resume the previous TLS session, sync pool
+#       connections idle for POOL_IDLE seconds are pinged before use (server restarted meanwhile).
+#       'sys,*' commands are safe to repeat, they are sent again once on a new connection when the first one is lost
+#
+import os
+import sys
+try:
+    import ssl
+    import yaml
+    import time
+    import queue
+    import socket
+    import asyncio
+    import threading
+    import itertools
+except ModuleNotFoundError as E:
+    print(f"{E}. Install required module.")
+    sys.exit(1)
+
+from botserver import defines
+from botserver import protocol
+
+POOL_SIZE   = 4                                 # Connections for each pool
+POOL_WINDOW = 64                                # Requests sent and not yet replied, for each connection
+POOL_IDLE   = 1.0                               # Idle seconds before a pooled connection is pinged again before use
+RETRIES     = 5                                 # Connection attempts before giving up
+BACKOFF     = 0.1                               # First reconnection delay (seconds), doubled on each attempt
+BACKOFF_MAX = 5.0
+
+
+# Client configuration file, botserver host, port and certificates
+class clientConfiguration():
+    @property
+    def valid(self):
+        return self.__valid
+    @property
+    def error(self):
+        return self.__error
+
+    # @param configuration (string) client.config.yaml or config.yaml file
+    # @param host          (string) Connect to [host] instead of the first configured one
+    def __init__(self, configuration=defines.FILE_CONFIG, host=None):
+        self.__valid = False
+        self.__error = ''
+        try:
+            # yaml loading
+            if not os.path.isfile(configuration): raise Exception(f"Cannot open '{configuration}' file")
+            with open(configuration, 'r') as fHandler:
+                config = yaml.safe_load(fHandler)
+            if 'botserverHost'    not in config: raise Exception("[botserverHost] not found in configuration file")
+            if 'botserverPort'    not in config: raise Exception("[botserverPort] not found in configuration file")
+            # Host connection
+            if host:
+                self.host = host
+            else:
+                hostList = config['botserverHost'].split(',')
+                if len(hostList)==0 or hostList[0]=='':
+                    self.host = '127.0.0.1'
+                else:
+                    self.host = hostList[0]
+            # Port, timeout (clients ping before server timeout)
+            self.port    = int(config['botserverPort'])
+            config['botserverTimeout'] = int(config['botserverTimeout']) if 'botserverTimeout' in config else 20
+            self.timeout = config['botserverTimeout']-5 if config['botserverTimeout']-5 > 0 else 20
+            # Verify server self signed certificate on client side. Default: False
+            self.selfSigned = bool(config['clientVerifySelfSigned']) if 'clientVerifySelfSigned' in config else False
+            # Certification files checkings
+            dirCertificates = os.path.dirname(configuration)
+            dirCertificates = ('.' if dirCertificates=='' else dirCertificates) + os.path.sep + 'certs' + os.path.sep
+            if 'clientCertificates' in config:      # Client configuration detected, use these info instead of default ones
+                if 'ca' not in config['clientCertificates'] or 'certificate' not in config['clientCertificates'] or 'key' not in config['clientCertificates']:
+                    raise Exception(f"Invalid configuration file: {configuration}")
+                self.caCertificate     = self.__checkFile('', config['clientCertificates']['ca'])
+                self.clientCertificate = self.__checkFile('', config['clientCertificates']['certificate'])
+                self.clientKey         = self.__checkFile('', config['clientCertificates']['key'])
+            else:
+                self.caCertificate     = self.__checkFile(dirCertificates, "ca_cert.pem")
+                self.clientCertificate = self.__checkFile(dirCertificates, "client_cert.pem")
+                self.clientKey         = self.__checkFile(dirCertificates, "client_key.pem")
+            self.__valid = True
+        except Exception as E:
+            self.__error = str(E)
+
+    # Detecting if certificates are there when needed
+    def __checkFile(self, dir, filename):
+        if os.path.exists(dir + filename):
+            return dir+filename
+        else:
+            raise Exception(f"File  {dir}{filename}  not found")
+
+    # @return (ssl.SSLContext) client side TLS context with client certificate loaded
+    def context(self):
+        context = ssl.create_default_context(purpose=ssl.Purpose.SERVER_AUTH, cafile=self.caCertificate)
+        context.load_cert_chain(certfile=self.clientCertificate, keyfile=self.clientKey)  # Load client certificate
+        # context.options |= ssl.OP_NO_TLSv1 | ssl.OP_NO_TLSv1_1  # optional
+        if self.selfSigned:
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+        else:
+            context.verify_mode = ssl.CERT_REQUIRED
+            if self.host in ['127.0.0.1', 'localhost', '::1']:        # Verify remote certificate (on remote, with a "real" hostname) or skip it when localhost
+                context.check_hostname = False
+            else:
+                context.check_hostname = True
+        return context
+
+
+# One framed protocol connection (blocking socket), used by a single thread at a time
+class connection():
+    def __init__(self, config, context):
+        self.__config  = config
+        self.__context = context
+        self.__socket  = None
+        self.__ids     = itertools.count(1)
+        self.used      = 0.0                    # Last request time (time.monotonic())
+
+    @property
+    def opened(self):
+        return self.__socket is not None
+
+    # Connect and switch to the framed protocol
+    # @param session (ssl.SSLSession) Previous session to resume, if any
+    # @return (ssl.SSLSession) session of this connection
+    def open(self, session=None):
+        clientSocket = socket.create_connection((self.__config.host, self.__config.port), timeout=self.__config.timeout)
+        try:
+            self.__socket = self.__context.wrap_socket(clientSocket, server_hostname=self.__config.host, session=session)
+            self.__socket.sendall(f'sys,{protocol.COMMAND}\n'.encode('UTF-8'))
+            reply = b''
+            while not reply.endswith(b'\n'):    # Negotiation reply only, frames follow
+                chunk = self.__socket.recv(1)
+                if not chunk:
+                    raise OSError('Disconnected from remote')
+                reply += chunk
+            if reply.decode('UTF-8').strip() != protocol.COMMAND:
+                raise ValueError(f"Framed protocol not supported by server ({reply.decode('UTF-8').strip()})")
+        except (OSError, ValueError):
+            self.close()
+            clientSocket.close()
+            raise
+        self.used = time.monotonic()
+        return self.__socket.session
+
+    def close(self):
+        if self.__socket is not None:
+            try:
+                self.__socket.sendall(protocol.frame(0, 'sys,exit'))
+                self.__socket.close()
+            except OSError:
+                pass
+            self.__socket = None
+
+    # Send [command] and wait for its reply
+    def request(self, command):
+        return self.pipeline([command])[0]
+
+    # Send every command in [commandList] without waiting for replies, at most [window] of them in flight
+    # @return (list) replies, same order as [commandList]
+    def pipeline(self, commandList, window=POOL_WINDOW):
+        if self.__socket is None:
+            raise OSError('Connection closed')
+        requestList = {str(next(self.__ids)): index for index in range(len(commandList))}
+        replies = [None] * len(commandList)
+        slots = threading.Semaphore(window)
+        failed = threading.Event()
+        sender = None
+        if len(commandList) > 1:                # Sending from another thread, the server may reply while we are still sending
+            sender = threading.Thread(target=self.__send, args=(list(requestList.keys()), commandList, slots, failed), daemon=True)
+            sender.start()
+        else:
+            self.__send(list(requestList.keys()), commandList, slots, failed)
+        try:
+            if failed.is_set() and sender is None:
+                raise OSError('Cannot send to remote')
+            for _ in commandList:
+                payload = protocol.receive(self.__socket)
+                if payload is None:
+                    raise OSError('Disconnected from remote')
+                (requestId, reply) = protocol.unframe(payload)
+                if requestId not in requestList:
+                    raise ValueError(f'Unexpected reply id [{requestId}]')
+                replies[requestList[requestId]] = reply
+                slots.release()
+        except (OSError, ValueError):
+            failed.set()
+            for _ in range(window):             # Unblock sender
+                slots.release()
+            self.close()
+            raise
+        finally:
+            if sender:
+                sender.join()
+            self.used = time.monotonic()
+        return replies
+
+    def __send(self, idList, commandList, slots, failed):
+        try:
+            for (requestId, command) in zip(idList, commandList):
+                slots.acquire()
+                if failed.is_set():
+                    return
+                self.__socket.sendall(protocol.frame(requestId, command))
+        except OSError:
+            failed.set()                        # receiver ends on socket timeout or close
+
+
+# Thread safe pool of framed connections
+class botClient():
+    # @param configuration (string) client.config.yaml or config.yaml file
+    # @param host          (string) Connect to [host] instead of the first configured one
+    # @param size          (int)    Max connections
+    # @param window        (int)    Requests in flight for each connection (sendMany)
+    def __init__(self, configuration=defines.FILE_CONFIG, host=None, size=POOL_SIZE, window=POOL_WINDOW, retries=RETRIES, backoff=BACKOFF):
+        self.__config = clientConfiguration(configuration=configuration, host=host)
+        if not self.__config.valid:
+            raise ValueError(self.__config.error)
+        self.__context = self.__config.context()
+        self.__size    = max(int(size), 1)
+        self.__window  = max(int(window), 1)
+        self.__retries = max(int(retries), 1)
+        self.__backoff = float(backoff)
+        self.__session = None                   # Last TLS session, resumed by new connections
+        self.__idle    = queue.LifoQueue()      # Most recently used first, the others may be closed by server timeout
+        self.__lock    = threading.Lock()
+        self.__created = 0
+        self.__closed  = threading.Event()
+        threading.Thread(target=self.__healthCheck, daemon=True).start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    # Close every idle connection, connections in use are closed when released
+    def close(self):
+        self.__closed.set()
+        while True:
+            try:
+                self.__idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+    # @return (string) chatbot reply to [message] from [username]
+    def send(self, username, message):
+        return self.command(f'msg,{username},{message}')
+
+    # @return (string) reply to a raw [command] ('sys,status', 'msg,username,message', ...)
+    def command(self, command):
+        for attempt in range(2 if command.startswith('sys,') else 1):
+            client = self.__acquire()           # Lost connection is closed, reopened here on second attempt
+            try:
+                return client.request(command)
+            except (OSError, ValueError) as E:
+                error = E
+            finally:
+                self.__release(client)
+        raise ConnectionError(f"{self.__config.host}:{self.__config.port} {error}")
+
+    # Send every (username, message) in [messageList] spread over the pool connections, pipelined
+    # @return (list) replies, same order as [messageList]. None for messages lost with their connection
+    def sendMany(self, messageList):
+        commandList = [f'msg,{username},{message}' for (username, message) in messageList]
+        if len(commandList) == 0:
+            return []
+        clientList = [self.__acquire()]
+        while len(clientList) < min(self.__size, len(commandList)):
+            client = self.__acquire(wait=False)
+            if client is None:
+                break
+            clientList.append(client)
+        replies = [None] * len(commandList)
+        threadList = []
+        for (index, client) in enumerate(clientList):
+            thread = threading.Thread(target=self.__sendMany, args=(client, commandList, replies, index, len(clientList)), daemon=True)
+            thread.start()
+            threadList.append(thread)
+        for thread in threadList:
+            thread.join()
+        return replies
+
+    def __sendMany(self, client, commandList, replies, first, step):
+        try:
+            for (index, reply) in zip(range(first, len(commandList), step), client.pipeline(commandList[first::step], self.__window)):
+                replies[index] = reply
+        except (OSError, ValueError):
+            pass
+        finally:
+            self.__release(client)
+
+    # Get an opened connection: idle one, new one (up to pool size) or wait for one
+    # @param wait (bool) False: return None instead of waiting
+    def __acquire(self, wait=True):
+        if self.__closed.is_set():
+            raise ConnectionError('Client closed')
+        try:
+            client = self.__idle.get_nowait()
+        except queue.Empty:
+            client = None
+            with self.__lock:
+                if self.__created < self.__size:
+                    self.__created += 1
+                    client = connection(self.__config, self.__context)
+            if client is None:
+                if not wait:
+                    return None
+                client = self.__idle.get()
+        self.__ping(client, POOL_IDLE)
+        if not client.opened:
+            try:
+                self.__open(client)
+            except ConnectionError:
+                self.__release(client)
+                raise
+        return client
+
+    def __release(self, client):
+        if self.__closed.is_set():
+            client.close()
+        self.__idle.put(client)
+
+    # Open [client] connection, retrying with exponential backoff
+    def __open(self, client):
+        for attempt in range(self.__retries):
+            try:
+                self.__session = client.open(session=self.__session)
+                return
+            except (OSError, ValueError) as E:
+                error = E
+                if isinstance(E, ssl.SSLError):
+                    self.__session = None
+            if attempt < self.__retries-1:
+                time.sleep(min(self.__backoff * 2**attempt, BACKOFF_MAX))
+        raise ConnectionError(f"Cannot connect to {self.__config.host}:{self.__config.port} ({error})")
+
+    # Ping idle connections before server timeout closes them, lost ones are reopened on next use
+    def __healthCheck(self):
+        while not self.__closed.wait(self.__config.timeout / 2):
+            clientList = []
+            while True:
+                try:
+                    clientList.append(self.__idle.get_nowait())
+                except queue.Empty:
+                    break
+            for client in clientList:
+                self.__ping(client, self.__config.timeout / 2)
+            for client in reversed(clientList):
+                self.__release(client)
+
+    # Ping [client] when idle for [idle] seconds or more, closed when lost (reopened on next use)
+    def __ping(self, client, idle):
+        if client.opened and time.monotonic() - client.used >= idle:
+            try:
+                if client.request('sys,ping') != 'pong':
+                    client.close()
+            except (OSError, ValueError):
+                pass                            # already closed by pipeline()
+
+
+# One framed protocol connection (asyncio), requests from any task are multiplexed and matched by id
+class asyncConnection():
+    def __init__(self, config, context):
+        self.__config  = config
+        self.__context = context
+        self.__writer  = None
+        self.__reader  = None
+        self.__task    = None
+        self.__pending = {}                     # requestId -> asyncio.Future
+        self.__ids     = itertools.count(1)
+        self.used      = 0.0
+
+    @property
+    def opened(self):
+        return self.__writer is not None
+
+    @property
+    def pending(self):
+        return len(self.__pending)
+
+    async def open(self):
+        (reader, writer) = await asyncio.wait_for(asyncio.open_connection(self.__config.host, self.__config.port, ssl=self.__context,
+                                                                          server_hostname=self.__config.host), timeout=self.__config.timeout)
+        try:
+            writer.write(f'sys,{protocol.COMMAND}\n'.encode('UTF-8'))
+            reply = (await asyncio.wait_for(reader.readline(), timeout=self.__config.timeout)).decode('UTF-8').strip()
+            if reply != protocol.COMMAND:
+                raise ValueError(f"Framed protocol not supported by server ({reply})")
+        except (OSError, ValueError, asyncio.TimeoutError):
+            writer.close()
+            raise
+        (self.__reader, self.__writer) = (reader, writer)
+        self.__task = asyncio.create_task(self.__receive())
+        self.used = time.monotonic()
+
+    async def close(self):
+        if self.__writer is not None:
+            writer = self.__writer
+            writer.write(protocol.frame(0, 'sys,exit'))
+            self.__fail(OSError('Connection closed'))
+            try:
+                await writer.wait_closed()
+            except (OSError, ssl.SSLError):
+                pass
+
+    # Send [command] and wait for its reply
+    async def request(self, command):
+        if self.__writer is None:
+            raise OSError('Connection closed')
+        requestId = str(next(self.__ids))
+        future = asyncio.get_running_loop().create_future()
+        self.__pending[requestId] = future
+        self.used = time.monotonic()
+        try:
+            self.__writer.write(protocol.frame(requestId, command))
+            await self.__writer.drain()
+        except OSError as E:
+            self.__fail(E)
+        return await future
+
+    # Reader task, replies may come in any order
+    async def __receive(self):
+        try:
+            while True:
+                header = await self.__reader.readexactly(protocol.HEADER.size)
+                (requestId, reply) = protocol.unframe(await self.__reader.readexactly(protocol.length(header)))
+                future = self.__pending.pop(requestId, None)
+                if future and not future.done():
+                    future.set_result(reply)
+                self.used = time.monotonic()
+        except (OSError, ValueError, asyncio.IncompleteReadError) as E:
+            self.__fail(OSError(f'Disconnected from remote ({E})'))
+
+    # Connection lost, every pending request gets [error]
+    def __fail(self, error):
+        if self.__task and self.__task is not asyncio.current_task():
+            self.__task.cancel()
+        if self.__writer is not None:
+            self.__writer.close()
+        (self.__reader, self.__writer, self.__task) = (None, None, None)
+        (pending, self.__pending) = (self.__pending, {})
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(error)
+
+
+# asyncio pool of framed connections, see botClient()
+class asyncBotClient():
+    def __init__(self, configuration=defines.FILE_CONFIG, host=None, size=POOL_SIZE, window=POOL_WINDOW, retries=RETRIES, backoff=BACKOFF):
+        self.__config = clientConfiguration(configuration=configuration, host=host)
+        if not self.__config.valid:
+            raise ValueError(self.__config.error)
+        self.__context  = self.__config.context()
+        self.__clients  = [asyncConnection(self.__config, self.__context) for _ in range(max(int(size), 1))]
+        self.__opening  = [asyncio.Lock() for _ in self.__clients]
+        self.__window   = max(int(window), 1)
+        self.__retries  = max(int(retries), 1)
+        self.__backoff  = float(backoff)
+        self.__health   = None
+        self.__closed   = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *_):
+        await self.close()
+
+    async def close(self):
+        self.__closed = True
+        if self.__health:
+            self.__health.cancel()
+        for client in self.__clients:
+            await client.close()
+
+    # @return (string) chatbot reply to [message] from [username]
+    async def send(self, username, message):
+        return await self.command(f'msg,{username},{message}')
+
+    # @return (string) reply to a raw [command]
+    async def command(self, command):
+        for attempt in range(2 if command.startswith('sys,') else 1):
+            client = await self.__acquire()     # Lost connection is closed, reopened here on second attempt
+            try:
+                return await client.request(command)
+            except (OSError, ValueError) as E:
+                error = E
+        raise ConnectionError(f"{self.__config.host}:{self.__config.port} {error}")
+
+    # Send every (username, message) in [messageList] concurrently, at most [window] in flight for each connection
+    # @return (list) replies, same order as [messageList]. None for messages lost with their connection
+    async def sendMany(self, messageList):
+        slots = asyncio.Semaphore(self.__window * len(self.__clients))
+        async def send(username, message):
+            async with slots:
+                try:
+                    return await self.send(username, message)
+                except ConnectionError:
+                    return None
+        return list(await asyncio.gather(*[send(username, message) for (username, message) in messageList]))
+
+    # Least busy connection, opened if needed (opened ones are preferred)
+    async def __acquire(self):
+        if self.__closed:
+            raise ConnectionError('Client closed')
+        if self.__health is None:
+            self.__health = asyncio.create_task(self.__healthCheck())
+        index = min(range(len(self.__clients)), key=lambda i: (self.__clients[i].pending >= self.__window or not self.__clients[i].opened,
+                                                               self.__clients[i].pending))
+        async with self.__opening[index]:
+            if not self.__clients[index].opened:
+                await self.__open(self.__clients[index])
+        return self.__clients[index]
+
+    # Open [client] connection, retrying with exponential backoff
+    async def __open(self, client):
+        for attempt in range(self.__retries):
+            try:
+                await client.open()
+                return
+            except (OSError, ValueError, asyncio.TimeoutError) as E:
+                error = E
+            if attempt < self.__retries-1:
+                await asyncio.sleep(min(self.__backoff * 2**attempt, BACKOFF_MAX))
+        raise ConnectionError(f"Cannot connect to {self.__config.host}:{self.__config.port} ({error})")
+
+    # Ping idle connections before server timeout closes them
+    async def __healthCheck(self):
+        while not self.__closed:
+            await asyncio.sleep(self.__config.timeout / 2)
+            for client in self.__clients:
+                if client.opened and client.pending == 0 and time.monotonic() - client.used >= self.__config.timeout / 2:
+                    try:
+                        if await asyncio.wait_for(client.request('sys,ping'), timeout=self.__config.timeout) != 'pong':
+                            await client.close()
+                    except (OSError, ValueError, asyncio.TimeoutError):
+                        await client.close()
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+# pyright: reportMissingImports=false
+#
+# Inference backends used by the chat engine, each one exposes predict(matrix) -> matrix of probabilities
+# and predictIndices(list of input columns lists) for binary inputs given as active columns only
+#       keras   Full keras/tensorflow model    (defines.FILE_MODEL)
+#       numpy   Pure numpy forward pass         (defines.FILE_WEIGHTS), tensorflow is never imported
+# @see:
+#       load()          Load the model with the requested backend
+#       export()        Save weights from a keras model for the numpy backend (used by trainer)
+#       featureIndex()  Vocabulary word -> model input column, for the feature mode the model was trained with
+#
+
+# Program imports
+try:
+    import os
+    import sys
+    import zlib
+    import json
+    import numpy
+    import defines
+except ModuleNotFoundError as E:
+    print(f"{E}. Install required modules.")
+    sys.exit(1)
+
+BACKENDS = ['keras', 'numpy']
+FEATURES = ['dense', 'hashed']
+
+
+# Keras backend, tensorflow is imported only when this one is selected
+class kerasModel():
+    def __init__(self, filename=None):
+        import keras
+        self.__model = keras.models.load_model(filename)
+        self.inputSize = self.__model.input_shape[1]
+
+    def predict(self, matrix):
+        return self.__model.predict(matrix)
+
+    def predictIndices(self, indexList):
+        matrix = numpy.zeros((len(indexList), self.inputSize), dtype=numpy.float32)
+        for row, indices in enumerate(indexList):
+            matrix[row, indices] = 1
+        return self.predict(matrix)
+
+
+# Pure numpy backend, Dense layers only (Dropout is an identity function at inference time)
+class numpyModel():
+    ACTIVATIONS = {
+        'linear':   lambda x: x,
+        'relu':     lambda x: numpy.maximum(x, 0),
+        'sigmoid':  lambda x: 1 / (1 + numpy.exp(-x)),
+        'tanh':     numpy.tanh,
+        'softmax':  lambda x: numpyModel.softmax(x),
+    }
+
+    # @param arrays (dict) Weights already loaded (knowledge bundle, memory mapped), same names used in [filename]
+    def __init__(self, filename=None, arrays=None):
+        self.__layers = []
+        if arrays is None:
+            with numpy.load(filename) as data:
+                self.__loadLayers(data, filename)
+        else:
+            self.__loadLayers(arrays, 'knowledge bundle')
+        self.inputSize = self.__layers[0][0].shape[0]
+
+    def __loadLayers(self, data, source):
+        for i, activation in enumerate(data['activations']):
+            if str(activation) not in self.ACTIVATIONS:
+                raise ValueError(f"Unsupported activation '{activation}' in '{source}'")
+            self.__layers.append((data[f'kernel{i}'], data[f'bias{i}'], self.ACTIVATIONS[str(activation)]))
+
+    @staticmethod
+    def softmax(x):
+        e = numpy.exp(x - numpy.max(x, axis=-1, keepdims=True))
+        return e / numpy.sum(e, axis=-1, keepdims=True)
+
+    def predict(self, matrix):
+        result = numpy.asarray(matrix, dtype=numpy.float32)
+        for (kernel, bias, activation) in self.__layers:
+            result = activation(result @ kernel + bias)
+        return result
+
+    # Embedding bag: first layer is the sum of the kernel rows of active columns, cost grows with message
+    # words instead of input size
+    def predictIndices(self, indexList):
+        (kernel, bias, activation) = self.__layers[0]
+        result = numpy.empty((len(indexList), kernel.shape[1]), dtype=numpy.float32)
+        for row, indices in enumerate(indexList):
+            result[row] = kernel[indices].sum(axis=0)
+        result = activation(result + bias)
+        for (kernel, bias, activation) in self.__layers[1:]:
+            result = activation(result @ kernel + bias)
+        return result
+
+
+# Load model from [path] directory with the requested [backend]
+def load(path=None, backend='keras'):
+    if backend == 'keras':
+        return kerasModel(path + os.path.sep + defines.FILE_MODEL)
+    elif backend == 'numpy':
+        return numpyModel(path + os.path.sep + defines.FILE_WEIGHTS)
+    raise ValueError(f"Unknown inference backend '{backend}', valid values: {BACKENDS}")
+
+
+# Model input columns for vocabulary [words], as trainer built them with [features] settings
+#       dense   one column for each word, input size grows with vocabulary
+#       hashed  crc32(word) modulo [dimension] columns, fixed input size (colliding words share a column)
+# @return (tuple) (dict word -> column, input size)
+def featureIndex(words=[], features={}):
+    mode = features.get('mode', 'dense')
+    if mode == 'dense':
+        return ({w: i for i, w in enumerate(words)}, len(words))
+    elif mode == 'hashed':
+        dimension = int(features['dimension'])
+        return ({w: zlib.crc32(w.encode('UTF-8')) % dimension for w in words}, dimension)
+    raise ValueError(f"Unknown feature mode '{mode}', valid values: {FEATURES}")
+
+# Feature settings saved by trainer in [path] directory, dense for models trained without them
+def featuresLoad(path=None):
+    try:
+        with open(path + os.path.sep + defines.FILE_FEATURES, 'r') as featuresFile:
+            return json.load(featuresFile)
+    except FileNotFoundError:
+        return {'mode': 'dense'}
+
+
+# Export Dense layers weights and activations from a keras [model] into [filename] (numpy .npz format)
+def export(model=None, filename=None):
+    arrays = {}
+    activations = []
+    for layer in model.layers:
+        if layer.__class__.__name__ == 'Dropout':
+            continue
+        if layer.__class__.__name__ != 'Dense':
+            raise ValueError(f"Layer '{layer.name}' ({layer.__class__.__name__}) cannot be exported")
+        (kernel, bias) = layer.get_weights()
+        arrays[f'kernel{len(activations)}'] = kernel.astype(numpy.float32)
+        arrays[f'bias{len(activations)}']   = bias.astype(numpy.float32)
+        activations.append(layer.get_config()['activation'])
+    arrays['activations'] = numpy.array(activations)
+    with open(filename, 'wb') as fHandler:
+        numpy.savez(fHandler, **arrays)
@@ -35,8 +35,32 @@ class serverConfiguration():
             if 'botserverPort'    not in config: raise Exception("[botserverPort] not found in configuration file")
             if 'allowedClients'   not in config: raise Exception("[allowedClients] not found in configuration file")
             if 'botserverTimeout' not in config: config['botserverTimeout'] = 30
+            if 'botserverMode'    not in config: config['botserverMode'] = 'thread' # Server mode [thread, async]
+            if 'botserverConcurrency' not in config: config['botserverConcurrency'] = 4    # Engine worker threads in [async] mode
+            if 'botserverProcesses' not in config: config['botserverProcesses'] = 1     # Pre-forked engine processes
+            if 'botserverTlsTickets' not in config: config['botserverTlsTickets'] = 2   # TLS 1.3 session tickets for each handshake (0: no resumption)
+            if config['botserverMode'] not in ['thread', 'async']: raise Exception(f"Invalid [botserverMode] '{config['botserverMode']}', valid values: thread, async")
             if 'chatThreshold'    not in config: config['chatThreshold'] = 0.25     # Recognition threshold
             if 'language'         not in config: config['language'] = ['en']        # Default language if not defined
+            if 'chatBackend'      not in config: config['chatBackend'] = 'keras'    # Inference backend [keras, numpy]
+            if 'usersBackend'     not in config: config['usersBackend'] = 'yaml'    # User database backend [yaml, sqlite]
+            if 'usersFlush'       not in config: config['usersFlush'] = 1.0         # sqlite backend, seconds between batched writes
+            if 'chatCache'        not in config: config['chatCache'] = {}           # Lemmatizer and prediction caches, items (0: disabled)
+            config['chatCache'].setdefault('lemma', 10000)
+            config['chatCache'].setdefault('sentence', 1000)
+            config['chatCache'].setdefault('intent', 0)
+            config['chatCache'].setdefault('intentTTL', 300)
+            if 'chatFeatures'     not in config: config['chatFeatures'] = {}       # Model input features, used by trainer (engine follows the trained model)
+            config['chatFeatures'].setdefault('mode', 'dense')
+            config['chatFeatures'].setdefault('dimension', 4096)
+            if config['chatFeatures']['mode'] not in ['dense', 'hashed']: raise Exception(f"Invalid [chatFeatures] mode '{config['chatFeatures']['mode']}', valid values: dense, hashed")
+            if 'chatLog'          not in config: config['chatLog'] = {}             # Chat log writer settings, see log.writer()
+            if 'chatReloadWatch'  not in config: config['chatReloadWatch'] = 0      # Seconds between db/ changes checks, reload when changed (0: disabled)
+            if 'statsFile'        not in config: config['statsFile'] = ''           # Prometheus text dump of sys,stats ('': disabled)
+            if 'statsInterval'    not in config: config['statsInterval'] = 60       # Seconds between [statsFile] updates
+            if 'botserverBatch'   not in config: config['botserverBatch'] = {}      # Micro-batching scheduler, disabled by default
+            config['botserverBatch'].setdefault('size', 1)
+            config['botserverBatch'].setdefault('wait', 5)
             self.__property = config
             # Checking existence of Server and CA certs
             dirCertificates = os.path.dirname(self.filename)
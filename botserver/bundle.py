@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+#
+# Knowledge bundle: intents, vocabulary, classes, lemmatized patterns and numpy weights in a single file
+# written by trainer (defines.FILE_BUNDLE) and memory mapped by the chat engine. Weights are used straight
+# from the mapped file, every engine process on the same host shares the same pages
+# @see:
+#       save()          Write a bundle (trainer)
+#       knowledge()     Map and verify a bundle, knowledge.stale() compares it with db/*.json sources. The sha256 of the
+#                       whole file is checked once for each bundle file (inode, size, mtime) a process loads
+#       sources()       db/*.json files hashes, stored in the bundle to detect stale ones
+#
+#       File layout:
+#           fixed header    magic (8 bytes), version (uint32), json header size (uint32), sha256 of everything after the fixed header
+#           json header     knowledge items, weights section size and table {name: [offset, shape, dtype]}, offsets from weights section
+#           weights         raw arrays, each one aligned to ALIGN bytes
+#
+
+# Program imports
+try:
+    import os
+    import sys
+    import mmap
+    import json
+    import glob
+    import numpy
+    import struct
+    import hashlib
+    import defines
+except ModuleNotFoundError as E:
+    print(f"{E}. Install required modules.")
+    sys.exit(1)
+
+MAGIC   = b'BOTKNOWL'
+VERSION = 1
+HEADER  = struct.Struct('!8sII32s')             # magic, version, json header size, sha256
+ALIGN   = 64                                    # Arrays alignment (bytes)
+
+_verified = {}                                  # filename -> (inode, size, mtime) of the bundle whose checksum matched
+
+
+# @return (dict) {filename: sha256} for each db/*.json file in [path]
+def sources(path):
+    hashList = {}
+    for filename in sorted(glob.glob(path + os.path.sep + '*.json')):
+        with open(filename, 'rb') as jsonFile:
+            hashList[os.path.basename(filename)] = hashlib.sha256(jsonFile.read()).hexdigest()
+    return hashList
+
+def _aligned(size):
+    return (size + ALIGN - 1) // ALIGN * ALIGN
+
+# Write [header] items (json serializable) and [arrays] (dict name -> numpy array) into [filename].
+# A temporary file replaces the previous bundle, engines still mapping the old one are not affected
+def save(filename, header, arrays):
+    arrays = {name: numpy.ascontiguousarray(array) for name, array in arrays.items()}
+    table = {}
+    offset = end = 0
+    for name, array in arrays.items():
+        table[name] = [offset, list(array.shape), array.dtype.str]         # offset from weights section start
+        end = offset + array.nbytes
+        offset = _aligned(end)
+    payload = json.dumps(dict(header, version=VERSION, arrays=table, weights=end)).encode('UTF-8')
+    data = bytearray(payload.ljust(_aligned(HEADER.size + len(payload)) - HEADER.size, b' '))
+    for name, array in arrays.items():
+        data += b'\0' * (_aligned(len(data) + HEADER.size) - HEADER.size - len(data))
+        data += array.tobytes()
+    with open(filename + '.tmp', 'wb') as bundleFile:
+        bundleFile.write(HEADER.pack(MAGIC, VERSION, len(payload), hashlib.sha256(data).digest()))
+        bundleFile.write(data)
+    os.replace(filename + '.tmp', filename)
+
+
+# Memory mapped knowledge bundle
+class knowledge():
+    # @param filename (string) Bundle file
+    # @param verify   (bool)   Check the sha256 of the whole file, reads every page unless this file was verified already
+    # @raise FileNotFoundError when there is no bundle, ValueError when it is not valid
+    def __init__(self, filename, verify=True):
+        self.__filename = filename
+        with open(filename, 'rb') as bundleFile:
+            self.__map = mmap.mmap(bundleFile.fileno(), 0, access=mmap.ACCESS_READ)
+            status = os.fstat(bundleFile.fileno())
+        signature = (status.st_ino, status.st_size, status.st_mtime_ns)
+        if len(self.__map) < HEADER.size:
+            raise ValueError(f"'{filename}' is not a knowledge bundle")
+        (magic, version, size, checksum) = HEADER.unpack_from(self.__map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"'{filename}' is not a knowledge bundle")
+        if version != VERSION:
+            raise ValueError(f"'{filename}' version {version} not supported (expected {VERSION})")
+        if verify and _verified.get(filename) != signature:
+            if hashlib.sha256(memoryview(self.__map)[HEADER.size:]).digest() != checksum:
+                raise ValueError(f"'{filename}' checksum mismatch")
+            _verified[filename] = signature
+        try:
+            self.header = json.loads(self.__map[HEADER.size:HEADER.size + size].decode('UTF-8'))
+        except ValueError:
+            raise ValueError(f"'{filename}' header is not valid")
+        start = _aligned(HEADER.size + size)
+        if not isinstance(self.header, dict) or self.header.get('weights') is None or start + self.header['weights'] != len(self.__map):
+            raise ValueError(f"'{filename}' size mismatch, truncated or incomplete")
+        # Read only arrays on the mapped file, no copies
+        self.arrays = {name: numpy.frombuffer(self.__map, dtype=numpy.dtype(dtype), count=int(numpy.prod(shape)), offset=start + offset).reshape(shape)
+                       for name, (offset, shape, dtype) in self.header['arrays'].items()}
+
+    # Compare this bundle with the sources it was built from and the model files trainer writes before it
+    # @param path      (string) db/ directory
+    # @param languages (list)   Lemmatizer languages in use
+    # @return (string) Why this bundle is stale, None when it is up to date
+    def stale(self, path, languages):
+        if self.header.get('sources') != sources(path):
+            return 'intent files changed'
+        if self.header.get('languages') != list(languages):
+            return 'languages changed'
+        created = os.stat(self.__filename).st_mtime
+        for name in [defines.FILE_WORDS, defines.FILE_CLASSES, defines.FILE_MODEL, defines.FILE_WEIGHTS, defines.FILE_FEATURES]:
+            if os.path.exists(path + os.path.sep + name) and os.stat(path + os.path.sep + name).st_mtime > created:
+                return f'{name} is newer'
+        return None
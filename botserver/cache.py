@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+#
+# Bounded, thread safe LRU cache with hit/miss counters and optional expiration time
+# @see:
+#       self.get()      Cached value or None
+#       self.set()      Store a value, least recently used items are evicted when [size] is reached
+#                       and every item expires after [ttl] seconds (if any)
+#       self.stats()    Counters dictionary {size, ttl, items, hits, misses}
+#
+
+# Program imports
+try:
+    import sys
+    import time
+    import threading
+    import collections
+except ModuleNotFoundError as E:
+    print(f"{E}. Install required modules.")
+    sys.exit(1)
+
+# LRU cache [import cache=cache.lruCache()]
+class lruCache():
+    @property
+    def hits(self):
+        return self.__hits
+    @property
+    def misses(self):
+        return self.__misses
+
+    # Class constructor
+    # @param size (int)   Max number of items, 0 disables the cache
+    # @param ttl  (float) Item expiration time (seconds), 0 never expires
+    def __init__(self, size=1024, ttl=0):
+        self.__size   = size if size > 0 else 0
+        self.__ttl    = ttl if ttl > 0 else 0
+        self.__items  = collections.OrderedDict()
+        self.__lock   = threading.Lock()
+        self.__hits   = 0
+        self.__misses = 0
+
+    def __len__(self):
+        return len(self.__items)
+
+    # @return cached value for [key], None if not found
+    def get(self, key):
+        with self.__lock:
+            if key in self.__items:
+                (value, expiry) = self.__items[key]
+                if expiry == 0 or expiry > time.monotonic():
+                    self.__items.move_to_end(key)
+                    self.__hits += 1
+                    return value
+                del self.__items[key]
+            self.__misses += 1
+            return None
+
+    def set(self, key, value):
+        if self.__size == 0:
+            return
+        with self.__lock:
+            self.__items[key] = (value, time.monotonic() + self.__ttl if self.__ttl > 0 else 0)
+            self.__items.move_to_end(key)
+            while len(self.__items) > self.__size:
+                self.__items.popitem(last=False)
+
+    def clear(self):
+        with self.__lock:
+            self.__items.clear()
+
+    def stats(self):
+        return {'size': self.__size, 'ttl': self.__ttl, 'items': len(self.__items), 'hits': self.__hits, 'misses': self.__misses}
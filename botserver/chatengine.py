@@ -18,15 +18,19 @@ os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
 try:
     # Python imports
     import nltk
-    import keras
-    import numpy
+    import time
     import pickle
+    import glob
     import random
-    import string
+    import threading
     import simplemma                                    # Good lemmatizer with local languages extensions
 
     # Program imports
     import log
+    import cache
+    import stats
+    import bundle
+    import backend
     import users
     import intent
     import defines
@@ -37,6 +41,22 @@ except ModuleNotFoundError as E:
     sys.exit(1)
 
 
+# Engine knowledge snapshot (intents, model, vocabulary, classes and everything precomputed from them).
+# Never changed once built, chatEngine.reload() replaces it as a whole
+class engineState():
+    def __init__(self, intents=None, model=None, words=None, classes=None, intentCache=None, features=None):
+        self.intents      = intents                                         # intent.database()
+        self.model        = model                                           # backend.load()
+        self.words        = words                                           # Word array list
+        self.features     = features or {'mode': 'dense'}                   # backend.featuresLoad()
+        (self.wordIndex, self.inputSize) = backend.featureIndex(words or [], self.features)    # word -> model input column
+        self.classes      = classes                                         # Class list, array with all "tag" items
+        self.intentCache  = intentCache                                     # Predicted intents cache, only valid for this model
+        self.patternIndex = {}                                              # Lemmatized patterns, variable slots marked
+        self.templates    = {}                                              # Compiled responses, response -> template segments
+        self.variableFree = set()                                           # Tags without variables in patterns
+
+
 # Parsing input arguments
 class chatEngine():
     @property
@@ -47,79 +67,230 @@ class chatEngine():
         return self.__error
 
     # Class constructor/destructor
-    def __init__(self, pathProgram=None, debug=False):
+    # @param userStore (dict) Shared users dictionary (see users.database.share()) for multi process daemons
+    # @param readOnly  (bool) Offline tools: users kept in memory, nothing written to chat.log, db/ not watched
+    # @param onError   (func) onError(message) for background errors (users database writes), also written to chat.log
+    def __init__(self, pathProgram=None, debug=False, userStore=None, readOnly=False, onError=None):
         try:
             config = serverConfiguration(configFile= pathProgram+os.path.sep+defines.FILE_CONFIG)
             if not config.valid: raise Exception(config.error)
             self.__threshold    = config.property['chatThreshold']
             self.__languageData = tuple(config.property['language'])
+            self.__backend      = config.property['chatBackend']
             #
             self.__pathDb       = pathProgram + os.path.sep + "db"
             self.__modules      = modules.modules(pathProgram+os.path.sep+"botserver"+os.path.sep+"module", config.property['plugin'])
-            self.__log          = log.writer(self.__pathDb)
+            self.__log          = log.null() if readOnly else log.writer(self.__pathDb, config.property['chatLog'])
             self.__sys          = {}            # Internal engine dict, used in self.__evaluate()
+            self.__lemmaCache   = cache.lruCache(size=int(config.property['chatCache']['lemma']))       # token -> lemma
+            self.__sentenceCache = cache.lruCache(size=int(config.property['chatCache']['sentence']))    # message -> lemmatized words
+            self.__intentCache  = (int(config.property['chatCache']['intent']), float(config.property['chatCache']['intentTTL']))   # (size, ttl)
             self.__debugMode    = debug
+            self.__onError      = onError
+            self.__users        = users.database(self.__pathDb, store={} if readOnly else userStore, backend=config.property['usersBackend'],     # User's list with possible
+                                                 flush=float(config.property['usersFlush']),                                # knowledge about them
+                                                 onError=self.__backgroundError)
+            self.__reloadLock   = threading.Lock()
             self.reload()
+            stats.register(self.__cacheCounters)
+            if float(config.property['chatReloadWatch']) > 0 and not readOnly:
+                threading.Thread(target=self.__watch, args=(float(config.property['chatReloadWatch']),), daemon=True).start()
             self.__valid        = True
             self.__log.Write(message1='INFO', message2="Engine initialized")
         except Exception as E:
             self.__error   = str(E).strip()
             self.__valid   = False
 
+    # Background error report, see onError
+    def __backgroundError(self, message):
+        self.__log.Write(message1='ERROR', message2=message)
+        if self.__onError:
+            self.__onError(message)
+
     def __debug(self, message):
         if self.__debugMode:
             print(message)
 
-    def reload(self):
-        self.__users   = users.database(self.__pathDb)                                                   # User's list with possible knowledge about them
-        self.__intents = intent.database(self.__pathDb)                                                  # Array with all possible intents
-        self.__model   = keras.models.load_model(self.__pathDb + os.path.sep + defines.FILE_MODEL)       # Applied keras model
-        self.__words   = pickle.load(open(self.__pathDb + os.path.sep + defines.FILE_WORDS, 'rb'))       # Word array list
-        self.__classes = pickle.load(open(self.__pathDb + os.path.sep + defines.FILE_CLASSES, 'rb'))     # Class list, array with all "tag" items
+    # Load knowledge from db/ into a new snapshot and swap it in with a single assignment.
+    # Messages already running end their work on the previous snapshot
+    # @param wait (bool) False: reload on a background thread and return immediately
+    # @return (bool) False if another reload is still running
+    def reload(self, wait=True):
+        if not self.__reloadLock.acquire(blocking=False):
+            return False
+        if not wait:
+            threading.Thread(target=self.__reloadBackground, daemon=True).start()
+            return True
+        try:
+            self.__reload()
+        finally:
+            self.__reloadLock.release()
+        return True
+
+    def __reload(self):
+        state = self.__reloadBundle()
+        if state is None:
+            state = engineState(intents     = intent.database(self.__pathDb),
+                                model       = backend.load(self.__pathDb, self.__backend),
+                                words       = pickle.load(open(self.__pathDb + os.path.sep + defines.FILE_WORDS, 'rb')),
+                                classes     = pickle.load(open(self.__pathDb + os.path.sep + defines.FILE_CLASSES, 'rb')),
+                                intentCache = cache.lruCache(size=self.__intentCache[0], ttl=self.__intentCache[1]),
+                                features    = backend.featuresLoad(self.__pathDb))
+            state.patternIndex = self.__detectUserVariablesCompile(state.intents)
+        if state.model.inputSize != state.inputSize:
+            raise ValueError(f"Model input size ({state.model.inputSize}) does not match {state.features['mode']} features ({state.inputSize}), train the model again")
+        state.variableFree = {tag for tag in state.patternIndex if not any(word[0:2]=='{{' for pattern in state.patternIndex[tag] for word in pattern)}
         self.__modules.load()
+        state.templates    = {response: self.__compileTemplate(response) for tag in state.intents.tags for response in state.intents.responses(tag)}
+        self.__state = state
+
+    # Knowledge from trainer bundle (defines.FILE_BUNDLE): nothing to parse or lemmatize, numpy backend weights
+    # are used from the memory mapped file
+    # @return (engineState) None when there is no bundle or it is not up to date with db/ files
+    def __reloadBundle(self):
+        try:
+            knowledge = bundle.knowledge(self.__pathDb + os.path.sep + defines.FILE_BUNDLE)
+            reason = knowledge.stale(self.__pathDb, self.__languageData)
+            if reason:
+                raise ValueError(f"stale, {reason}")
+        except FileNotFoundError:
+            return None
+        except ValueError as E:
+            self.__log.Write(message1='WARNING', message2=f"Knowledge bundle not used ({str(E).strip()}), loading db/ files")
+            return None
+        state = engineState(intents     = intent.database(self.__pathDb, intentList=knowledge.header['intents']),
+                            model       = backend.numpyModel(arrays=knowledge.arrays) if self.__backend == 'numpy' else backend.load(self.__pathDb, self.__backend),
+                            words       = knowledge.header['words'],
+                            classes     = knowledge.header['classes'],
+                            intentCache = cache.lruCache(size=self.__intentCache[0], ttl=self.__intentCache[1]),
+                            features    = knowledge.header['features'])
+        state.patternIndex = knowledge.header['patterns']
+        simplemma.lemmatize('botserver', lang=self.__languageData)         # Lemmatizer dictionaries load now, not on first message
+        return state
+
+    def __reloadBackground(self):
+        try:
+            self.__reload()
+            self.__log.Write(message1='INFO', message2="Engine reloaded")
+        except Exception as E:
+            self.__log.Write(message1='ERROR', message2=f"Engine reload failed, previous knowledge kept ({str(E).strip()})")
+        finally:
+            self.__reloadLock.release()
+
+    # Watch db/ knowledge files and reload when they change. Files must be unchanged for two checks in a row
+    # (trainer writes them one after another)
+    def __watch(self, interval):
+        loaded = current = self.__watchSignature()
+        while True:
+            time.sleep(interval)
+            previous, current = current, self.__watchSignature()
+            if current == previous and current != loaded:
+                loaded = current
+                self.reload(wait=False)
+
+    # @return (list) (filename, mtime, size) for every knowledge file
+    def __watchSignature(self):
+        fileList = glob.glob(self.__pathDb + os.path.sep + '*.json')
+        fileList += [self.__pathDb + os.path.sep + name for name in [defines.FILE_WORDS, defines.FILE_CLASSES, defines.FILE_MODEL, defines.FILE_WEIGHTS, defines.FILE_FEATURES, defines.FILE_BUNDLE]]
+        signature = []
+        for filename in sorted(fileList):
+            try:
+                info = os.stat(filename)
+                signature.append((filename, info.st_mtime, info.st_size))
+            except OSError:
+                pass
+        return signature
 
 
     def __CleanupSentence(self, message):
+        sentenceWords = self.__sentenceCache.get(message)
+        if sentenceWords is not None:
+            return list(sentenceWords)
         # tokenize the pattern - split words into array
-        sentenceWords = []
-        w = nltk.word_tokenize(message)
-        # stem each word - create short form for word
-        sentenceWords.extend(w)
-        return [simplemma.lemmatize(w.lower(), lang=(self.__languageData)) for w in sentenceWords if w not in defines.IGNORE_WORDS]
-
-
-    # return bag of words array: 0 or 1 for each word in the bag that exists in the sentence
-    def __bow(self, message):
-        # tokenize the pattern
-        sentenceWords = self.__CleanupSentence(message)
-        # bag of words - matrix of N words, vocabulary matrix
-        bag = [0]*len(self.__words)
+        sentenceWords = [self.__lemmatize(w) for w in nltk.word_tokenize(message) if w not in defines.IGNORE_WORDS]
+        self.__sentenceCache.set(message, tuple(sentenceWords))
+        return sentenceWords
+
+    # stem each word - create short form for word
+    def __lemmatize(self, word):
+        word = word.lower()
+        lemma = self.__lemmaCache.get(word)
+        if lemma is None:
+            lemma = simplemma.lemmatize(word, lang=(self.__languageData))
+            self.__lemmaCache.set(word, lemma)
+        return lemma
+
+    # Lemma, sentence and intent cache counters
+    # @return (dict) {'lemma': {size, ttl, items, hits, misses}, 'sentence': {...}, 'intent': {...}}
+    def cacheStats(self):
+        return {'lemma': self.__lemmaCache.stats(), 'sentence': self.__sentenceCache.stats(), 'intent': self.__state.intentCache.stats()}
+
+    # cacheStats() as stats.register() counters
+    def __cacheCounters(self):
+        counterList = []
+        for name, item in self.cacheStats().items():
+            counterList += [('cache_hits_total', {'cache': name}, item['hits']), ('cache_misses_total', {'cache': name}, item['misses'])]
+        return counterList
+
+
+    # return bag of words as active model input columns, one for each sentence word in the vocabulary
+    # (sparse bag: the message length drives its cost, not vocabulary size)
+    # @param sentenceWords (list) message already tokenized and lemmatized, see __CleanupSentence()
+    def __bow(self, state, sentenceWords):
+        bag = set()
         matchList = []
-        self.__debug(f"        words {self.__words}\n")
+        if self.__debugMode:
+            self.__debug(f"        words {state.words}\n")
         for s in sentenceWords:
             matchList.append(s)
             self.__debug(f"        bag '{s}'")
-            for i, w in enumerate(self.__words):
-                if w == s:
-                    # assign 1 if current word is in the vocabulary position
-                    bag[i] = 1
-                    self.__debug(f"            MATCH  ->  {{pos:{i+1}, word:{w}}}")
-        return (numpy.array(bag), matchList)
+            i = state.wordIndex.get(s)
+            if i is not None:
+                # current word is in the vocabulary, its input column is set
+                bag.add(i)
+                self.__debug(f"            MATCH  ->  {{pos:{i+1}, word:{s}}}")
+        return (list(bag), matchList)
 
     # Predict possible matches from user's message
     # @return (list) array of dicts {"intent": intentName, "probability": percentage}
-    def __predictClass(self, message=None):
-        # filter out predictions below a threshold
-        (p, matchPhrase) = self.__bow(message)
-        res = self.__model.predict(numpy.array([p]))[0]
-        results = [[i,r] for i,r in enumerate(res) if r>self.__threshold]
-        # sort by strength of probability
-        results.sort(key=lambda x: x[1], reverse=True)
-        return_list = []
-        for r in results:
-            return_list.append({"intent": self.__classes[r[0]], "probability": str(r[1])})
-        self.__debug(f"        predict\n            {return_list}")                 # [{'intent': '...', 'probability': '...'}]
-        return (return_list, matchPhrase)
+    def __predictClass(self, state, message=None):
+        return self.__predictClasses(state, messageList=[message])[0]
+
+    # Predict possible matches for a list of messages with a single model call
+    # @return (list) array of tuples (intents, matchPhrase), one for each message in [messageList]
+    def __predictClasses(self, state, messageList=[]):
+        if len(messageList) == 0:
+            return []
+        resultList = [None] * len(messageList)
+        bagList = []
+        predictList = []
+        for index, message in enumerate(messageList):
+            sentenceWords = self.__CleanupSentence(message)
+            cachedIntents = state.intentCache.get(tuple(sentenceWords))        # Same words, same prediction: model skipped
+            if cachedIntents is not None:
+                self.__debug(f"        predict (cached)\n            {cachedIntents}")
+                resultList[index] = (list(cachedIntents), sentenceWords)
+                continue
+            (p, matchPhrase) = self.__bow(state, sentenceWords)
+            bagList.append(p)
+            predictList.append((index, matchPhrase))
+        if len(bagList) == 0:
+            return resultList
+        res = state.model.predictIndices(bagList)
+        for row, (index, matchPhrase) in zip(res, predictList):
+            # filter out predictions below a threshold
+            results = [[i,r] for i,r in enumerate(row) if r>self.__threshold]
+            # sort by strength of probability
+            results.sort(key=lambda x: x[1], reverse=True)
+            return_list = []
+            for r in results:
+                return_list.append({"intent": state.classes[r[0]], "probability": str(r[1])})
+            self.__debug(f"        predict\n            {return_list}")             # [{'intent': '...', 'probability': '...'}]
+            # Cache predictions only for intents without user variables, no need to store every user's name
+            if len(return_list) == 0 or return_list[0]['intent'] in state.variableFree:
+                state.intentCache.set(tuple(matchPhrase), tuple(return_list))
+            resultList[index] = (return_list, matchPhrase)
+        return resultList
 
     # @param message  (string)          User's message
     # @param username (string)          current username
@@ -138,54 +309,23 @@ class chatEngine():
     # @param intents (list)   List of possible intent responses, example: [{"intent": intentName, "probability": percentage}]
     # @param phrase  (string) User's phrase
     # @return (dict) dictionary with user's variables
-    def __detectUserVariables(self, intents=[], phrase=None):
-        if len(intents) <= 0 or not phrase:
+    def __detectUserVariables(self, state, intents=[], phrase=None):
+        if len(intents) <= 0 or not phrase or intents[0]['intent'] in state.variableFree:
             return {}
-        replyIntentList = self.__detectUserVariablesIntent(intents[0]['intent'])    # Get first intent only
         matchWords = 0
         matchStatement = []
-        varList = {}
         index = 0
         matchIndex = -1
-        for intent in replyIntentList:
-            (varMasked, _, varList) = self.__detectUserVariablesSubstitute('', intent, varList)
-            intent = self.__CleanupSentence(varMasked)
-            intent = self.__detectUserVariablesReassign(intent, varList)
+        for intent in state.patternIndex.get(intents[0]['intent'], []):               # Get first intent only
             (matchWords, matchStatement, matchIndex) = self.__detectUserVariablesBestMatch(intent, phrase, index, matchWords, matchStatement, matchIndex)
             index += 1
         self.__debug(f'        matching ({matchWords} times) -> {matchStatement}\n            index({matchIndex}) -> {phrase}')
         return self.__detectUserVariablesAssign(matchStatement, phrase)             # Assign vars detected from user's phrase, if any
 
-    # @return (list) intent matching array statements
-    def __detectUserVariablesIntent(self, intentName):
-        for item in self.__intents.list['intents']:
-            if item['tag'] == intentName:
-                return item['patterns']
-        return []
-    # Substitute variable pattern '{{whatever}}' with random string in order to avoid messes with the lemmatizer
-    # @return (accumulator, leftPart, variableList)
-    #           accumulator  (string) Result string with all '{{var}}' substituted with random strings
-    #           leftPart     (_)      insignificant, string left to process (recursively). Should be '' at the end
-    #           variableList (dict)   Dictionary with the var list, something like: {'{{name,*}}': 'QYTXDKBIGFAOJYMFRIKJ', '{{name}}': 'PINSQGTNVRHUVXRRTXIX'}
-    def __detectUserVariablesSubstitute(self, accumulator, phrase, varList):
-        try:
-            matches = re.finditer(defines.REGEX, phrase, re.MULTILINE)
-            item = next(matches)
-            key = item.group()
-            if key not in varList:
-                varList[key] = ''.join(random.choice(string.ascii_lowercase) for x in range(20))
-            (accumulator, phrase, varList) = self.__detectUserVariablesSubstitute(accumulator+phrase[:item.start()]+varList[key], phrase[item.end():], varList)
-        except StopIteration as it:
-            accumulator += phrase
-        return (accumulator, phrase, varList)
-    # @param intent  (list) System intent matched with random string instead of vars
-    # @param varList (dict) Dictionary with the variables list
-    def __detectUserVariablesReassign(self, intent, varList):
-        for item in range(len(intent)):
-            for variable in varList:
-                if varList[variable] == intent[item]:
-                    intent[item] = variable
-        return intent
+    # Precompiled patterns index, built once on reload() when not loaded from the knowledge bundle
+    # @return (dict) {tag: [[word, '{{var}}', word, ...], ...]} for each intent, see intent.compilePatterns()
+    def __detectUserVariablesCompile(self, intents):
+        return intent.compilePatterns(intents, self.__CleanupSentence)
     # Detect how [intent] is close to users' [phrase]
     # @param intent         (array)  System intent to evaluate
     # @param phrase         (string) Current user phrase
@@ -225,80 +365,98 @@ class chatEngine():
 
 
     # Reply back to user, pick a random response from available response list
-    def __getResponse(self, intents):
+    def __getResponse(self, state, intents):
         if len(intents) == 0 or not intents:
             intents = [{'intent': 'noanswer', 'probability': '1.00'}]       # Don't know what it is, taking evasive action
-        tag = intents[0]['intent']
-        for i in self.__intents.list['intents']:
-            if i['tag']== tag:
-                result = random.choice(i['responses'])
-                break
+        result = random.choice(state.intents.responses(intents[0]['intent']))
         self.__debug(f'        random reply\n            "{result}"')
         return result
 
 
-    # Post processing evaluation, after picking a random reply it substitues user's environment vars
-    # @param accumulator (string) '' empty string at the beginning (recursive function), will contain the reply at the end
-    # @param remainder   (string) part of the string I still need to evaluate (selected user reply at the beginning)
+    # Post processing evaluation, after picking a random reply it substitues user's environment vars.
+    # Responses are compiled on reload (see __compileTemplate()), rendering is a single pass on template segments
+    # @param response    (string) Selected response
     # @param username    (string) Current username
-    # @return (tuple:[string,string])=(reply,'') System reply with all substitutions already in place
+    # @param moduleError (bool)   Rendering the 'moduleerror' response, no further error handling
+    # @return (string) System reply with all substitutions already in place
     #
     # @see Called from message() reply
-    def __evaluate(self, accumulator, remainder, username):
-        matches = re.finditer(defines.REGEX, remainder, re.MULTILINE)
+    def __evaluate(self, state, response, username, moduleError=False):
+        template = state.templates.get(response)
+        if template is None:
+            template = self.__compileTemplate(response)
+        result = []
         try:
-            item = next(matches)
-            value = self.__evaluateValue(originalValue=item.group(), username=username)
-            self.__debug(f'                - {item.group()} = {value}')
-            (accumulator, remainder) = self.__evaluate(accumulator + remainder[:item.start()] + value, remainder[item.end():], username)
+            for segment in template:
+                if segment[0] == 'text':
+                    result.append(segment[1])
+                    continue
+                value = self.__evaluateValue(segment, username)
+                self.__debug(f'                - {segment[1]} = {value}')
+                result.append(value)
 
         # Dynamic modules error handling
         except ValueError as valError:
-            remainder   = ''
-            accumulator = 'ERROR'
             self.__sys['module']  = valError.args[0]
-            moduleError = valError.args[1]
-            self.__debug(f'        ERROR, module [{self.__sys["module"]}]\n            '+moduleError)
-            self.__log.Write(message1='ERROR', message2=moduleError)
-            for intent in self.__intents.list['intents']:
-                if intent['tag'] == 'moduleerror':
-                    result = random.choice(intent['responses'])
-                    (accumulator, _) = self.__evaluate('', result, username)
-
-        # Loop stop, normal exit. Resuming operations
-        except StopIteration:
-            accumulator += remainder
-        return (accumulator, remainder)
+            self.__debug(f'        ERROR, module [{valError.args[0]}]\n            '+valError.args[1])
+            self.__log.Write(message1='ERROR', message2=valError.args[1])
+            if not moduleError and len(state.intents.responses('moduleerror')) > 0:
+                return self.__evaluate(state, random.choice(state.intents.responses('moduleerror')), username, moduleError=True)
+            return 'ERROR'
+        return ''.join(result)
+
+    # Split [response] into segments, placeholders are parsed and resolved once
+    # @return (tuple) ('text', string), ('user', placeholder, variable), ('module', placeholder), ('plugin', placeholder, moduleName, arguments)
+    def __compileTemplate(self, response):
+        template = []
+        position = 0
+        for item in re.finditer(defines.REGEX, response, re.MULTILINE):
+            if item.start() > position:
+                template.append(('text', response[position:item.start()]))
+            evaluate = item.group()[2:-2].split(',')                        # Remove {{}} and arg split
+            if evaluate[0] == 'user':                                       # User defined information
+                template.append(('user', item.group(), evaluate[1]) if len(evaluate) >= 2 else ('text', ''))
+            elif evaluate[0] == 'module':                                   # Module name, on module errors
+                template.append(('module', item.group()))
+            elif self.__modules.available(evaluate[0]):                     # Dynamically executed bot module (module.*)
+                template.append(('plugin', item.group(), evaluate[0], tuple(evaluate[1:])))
+            else:
+                template.append(('text', "(unknown command)"))
+            position = item.end()
+        if position < len(response):
+            template.append(('text', response[position:]))
+        return tuple(template)
 
 
     # Evaluating variables substitutions and sandboxed functions only
     # It won't NEVER be a plain eval() on everything (eval are pure evil)
-    def __evaluateValue(self, originalValue=None, username=None):
-        evaluate = originalValue[2:-2].split(',')                       # Remove {{}} and arg split
-        if len(evaluate) == 0:
-            return ''
-
+    # @param segment (tuple) Template placeholder segment, see __compileTemplate()
+    def __evaluateValue(self, segment, username=None):
         # User defined information, '' on None
-        elif evaluate[0] == 'user':
-            if len(evaluate) < 2:
-                return ''
-            value = self.__users.data(Username=username, Variable=evaluate[1])
-            if evaluate[1]=='name' and value is None:                   # Name not found, picking username instead
+        if segment[0] == 'user':
+            value = self.__users.data(Username=username, Variable=segment[2])
+            if segment[2]=='name' and value is None:                    # Name not found, picking username instead
                 value = self.__users.data(Username=username, Variable='username')
             return '' if not value else value
 
         # Internal module dictionary set, see (self.__evaluate([ValueError])) exception handling
-        elif evaluate[0] == 'module':       
-            return self.__sys['module']
+        elif segment[0] == 'module':
+            return self.__sys.get('module', '')
 
         # Dynamically execute a bot module from (module.*)
-        elif self.__modules.available(evaluate[0]):
-            return self.__modules.execute(evaluate[0], evaluate[1:])    # Slicing from 2nd element
+        elif segment[0] == 'plugin' and self.__modules.available(segment[2]):
+            return self.__modules.execute(segment[2], segment[3])
 
         # ?
         return "(unknown command)"
 
 
+    # Write queued chat.log records and pending user variables now. atexit does it on exit, forked worker
+    # processes leave without running atexit handlers
+    def close(self):
+        self.__log.close()
+        self.__users.close()
+
     # Send a <message> to <username>
     # @param  username (String) Referred user
     # @param  message  (String) Dedicated message
@@ -308,18 +466,71 @@ class chatEngine():
     def message(self, username=None, message=None):
         if not username or not message:
             return None
+        state = self.__state                                                    # Same knowledge snapshot for the whole message
         self.__debug("DEBUG MODE "+"^" * 59)
-        (intents, phrase) = self.__predictClass(message=message)                # Get prediction class
-        variables = self.__detectUserVariables(intents=intents, phrase=phrase)  # Detect user variables from phrase
+        timer = time.perf_counter()
+        (intents, phrase) = self.__predictClass(state, message=message)         # Get prediction class
+        self.__stage('predict', timer)
+        return self.__reply(state, username, message, intents, phrase)
+
+    # Send a list of messages, tokenized and predicted together with one model call
+    # @param  batch (list) Array of tuples (username, message)
+    #
+    # @return (list) Replied messages, same order as [batch]. None for each invalid item, error message for each failed one
+    def messages(self, batch=None):
+        batch = batch or []
+        state = self.__state
+        validList = [i for i, (username, message) in enumerate(batch) if username and message]
+        timer = time.perf_counter()
+        predictions = self.__predictClasses(state, messageList=[batch[i][1] for i in validList])
+        self.__stage('predict', timer)                                          # Whole batch
+        replies = [None] * len(batch)
+        for i, (intents, phrase) in zip(validList, predictions):
+            (username, message) = batch[i]
+            try:                                                                # Other replies of the batch are not affected
+                replies[i] = self.__reply(state, username, message, intents, phrase)
+            except Exception as E:
+                replies[i] = f"ERROR: {str(E).strip()}"
+        return replies
+
+    # Predict intents only, no reply: no context, users, modules or chat.log changes (offline evaluation)
+    # @param  messageList (list) Array of messages
+    #
+    # @return (list) Predicted intents for each message, same order as [messageList]: [{'intent': 'intentName', 'probability': '0.99'}, ...]
+    def classify(self, messageList=None):
+        messageList = messageList or []
+        state = self.__state
+        timer = time.perf_counter()
+        predictions = self.__predictClasses(state, messageList=messageList)
+        self.__stage('predict', timer)
+        return [intents for (intents, phrase) in predictions]
+
+    # Reply to an already predicted message, shared by message() and messages()
+    def __reply(self, state, username, message, intents, phrase):
+        timer = time.perf_counter()
+        variables = self.__detectUserVariables(state, intents=intents, phrase=phrase)   # Detect user variables from phrase
+        timer = self.__stage('detect', timer)
         self.__setContext(message=message, username=username, intents=intents, variables=variables)     # Context setup (if any) for predicted reply
-        result = self.__getResponse(intents)                                    # Get possible response and reply it back [result]
-        (result, _) = self.__evaluate("", result, username)                     # Post processing evaluation (variables substitution from environment data)
+        timer = self.__stage('context', timer)
+        result = self.__getResponse(state, intents)                             # Get possible response and reply it back [result]
+        timer = self.__stage('response', timer)
+        result = self.__evaluate(state, result, username)                       # Post processing evaluation (variables substitution from environment data)
+        self.__stage('evaluate', timer)
         self.__debug("_"*70 + "\n")
+        stats.count('engine_messages_total')
         if len(intents) == 0:
+            stats.count('engine_unanswered_total')
             self.logQuery(username, message)
         self.__log.Write(msgtype='message', message1=username, message2=message, message3=result)
         return result
 
+    # Add time elapsed from [start] to [stage] timings
+    # @return (float) current time, next stage start
+    def __stage(self, stage, start):
+        now = time.perf_counter()
+        stats.observe('engine_stage_seconds', now - start, stage=stage)
+        return now
+
 
     # Mark query into logfile as 'question not found' so it can be evaluated later on
     def logQuery(self, username, message, msgtype='ERROR', reason='QUESTION NOT FOUND'):
@@ -5,8 +5,13 @@ NAME    = 'T-800 Model 101'
 # local defines
 FILE_CONFIG    = 'config.yaml'
 FILE_MODEL     = 'model.h5'
+FILE_WEIGHTS   = 'model.npz'                                # numpy backend weights, exported from FILE_MODEL
 FILE_WORDS     = 'words.pkl'
 FILE_CLASSES   = 'classes.pkl'
+FILE_CORPUS    = 'corpus.pkl'                               # trainer preprocessed corpus cache
+FILE_MANIFEST  = 'model.manifest'                           # trainer manifest (json), what model files were built from
+FILE_FEATURES  = 'model.features'                           # model input features (json), see backend.featureIndex()
+FILE_BUNDLE    = 'knowledge.bundle'                         # trainer knowledge bundle, memory mapped by the engine (see bundle.py)
 
 # Variables recognition
 REGEX          = r"\{\{([A-Za-z0-9,\*%:\+\-\ ]+)\}\}"         # pattern match for {{vars}}
@@ -1,14 +1,20 @@
 # -*- coding: utf-8 -*-
 #
 # Load available intents (*.json) from [./db] directory
+# @see:
+#       compilePatterns()   Lemmatized patterns index with '{{var}}' slots, shared by chat engine and trainer (knowledge bundle)
 #
 
 # Program imports
 try:
     import os
     import sys
+    import re
     import json
     import glob
+    import random
+    import string
+    import defines
 except ModuleNotFoundError as E:
     print(f"{E}. Install required modules.")
     sys.exit(1)
@@ -18,12 +24,77 @@ class database():
     @property
     def list(self):
         return self.__intents
+    @property
+    def tags(self):
+        return self.__index.keys()
+
+    # @return (dict) intent with [tag] name, None if not found
+    def tag(self, tag):
+        return self.__index.get(tag)
+    # @return (list) responses for [tag] intent, [] if not found
+    def responses(self, tag):
+        return self.__responses.get(tag, [])
+    # @return (list) patterns for [tag] intent, [] if not found
+    def patterns(self, tag):
+        return self.__patterns.get(tag, [])
 
     # Constructor, load all json files into [intent] dictionary
-    def __init__(self, path):
+    # @param intentList (list) Intents already loaded (knowledge bundle), [path] is not read
+    def __init__(self, path, intentList=None):
         self.__intents = {}
         self.__intents['intents'] = []
-        intentList = glob.glob(path + os.path.sep + '*.json')
-        for filename in intentList:
-            with open(filename , 'r') as jsonFile:
-                self.__intents['intents'] += json.load(jsonFile)
+        if intentList is not None:
+            self.__intents['intents'] = list(intentList)
+        else:
+            for filename in glob.glob(path + os.path.sep + '*.json'):
+                with open(filename , 'r') as jsonFile:
+                    self.__intents['intents'] += json.load(jsonFile)
+        # Tag index, first defined intent wins when the same tag is found twice
+        self.__index = {}
+        for item in self.__intents['intents']:
+            if item['tag'] not in self.__index:
+                self.__index[item['tag']] = item
+        self.__responses = {tag: list(item.get('responses', [])) for tag, item in self.__index.items()}
+        self.__patterns  = {tag: list(item.get('patterns', []))  for tag, item in self.__index.items()}
+
+
+# Lemmatized patterns index. Every pattern is lemmatized with its '{{var}}' slots preserved
+# @param intents (database) Intents database
+# @param cleanup (function) message -> list of lemmatized words, same tokenizer and lemmatizer used for users' messages
+# @return (dict) {tag: [[word, '{{var}}', word, ...], ...]} for each intent
+def compilePatterns(intents, cleanup):
+    patternIndex = {}
+    for tag in intents.tags:
+        varList = {}
+        patternIndex[tag] = []
+        for pattern in intents.patterns(tag):
+            (varMasked, _, varList) = _substitute('', pattern, varList)
+            patternIndex[tag].append(_reassign(list(cleanup(varMasked)), varList))
+    return patternIndex
+
+# Substitute variable pattern '{{whatever}}' with a random string in order to avoid messes with the lemmatizer,
+# always the same string for the same variable
+# @return (accumulator, leftPart, variableList)
+#           accumulator  (string) Result string with all '{{var}}' substituted with random strings
+#           leftPart     (_)      insignificant, string left to process (recursively). Should be '' at the end
+#           variableList (dict)   Dictionary with the var list, something like: {'{{name,*}}': 'qytxdkbigfaojymfrikj', '{{name}}': 'pinsqgtnvrhuvxrrtxix'}
+def _substitute(accumulator, phrase, varList):
+    try:
+        matches = re.finditer(defines.REGEX, phrase, re.MULTILINE)
+        item = next(matches)
+        key = item.group()
+        if key not in varList:
+            varList[key] = ''.join(random.Random(key).choice(string.ascii_lowercase) for x in range(20))
+        (accumulator, phrase, varList) = _substitute(accumulator+phrase[:item.start()]+varList[key], phrase[item.end():], varList)
+    except StopIteration as it:
+        accumulator += phrase
+    return (accumulator, phrase, varList)
+
+# @param words   (list) Pattern words with random strings instead of vars
+# @param varList (dict) Dictionary with the variables list
+def _reassign(words, varList):
+    for item in range(len(words)):
+        for variable in varList:
+            if varList[variable] == words[item]:
+                words[item] = variable
+    return words
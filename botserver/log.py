@@ -1,14 +1,26 @@
 # -*- coding: utf-8 -*-
 #
 # chat engine log class
+# @see:
+#       Records are queued by Write() and written in batches by a background thread, every [flushInterval] seconds
+#       or as soon as [flushSize] records are waiting. Log file is rotated when it grows over [rotateSize] bytes
+#       or when it is older than [rotateTime] seconds, keeping [rotateCount] old files (chat.log.1, chat.log.2, ...)
+#       Engine processes sharing db/ write and rotate under an exclusive lock on chat.log.lock (its mtime is the last
+#       rotation time), a process finding chat.log rotated by another one reopens it before writing
 #
 
 # Program imports
 try:
     import os
+    import io
     import sys
     import csv
+    import time
+    import fcntl
+    import queue
+    import atexit
     import datetime
+    import threading
 except ModuleNotFoundError as E:
     print(f"{E}. Install required modules.")
     sys.exit(1)
@@ -16,21 +28,110 @@ except ModuleNotFoundError as E:
 # chat engine log writer [import log=log.writer()]
 class writer():
     # Class constructor/destructor
-    def __init__(self, path=None):
-        self.__logFile = None
-        filename = path + os.path.sep + 'chat.log'
-        self.__csvfile = open(filename, 'a+')
-        self.__logFile = csv.writer(self.__csvfile, delimiter='|')
-        if self.__logFile == None:
-            raise ValueError(f"Cannot open '{filename}' for writing")
-    
+    # @param configuration (dict) Optional settings: flushInterval, flushSize, rotateSize, rotateTime, rotateCount (0: disabled)
+    def __init__(self, path=None, configuration=None):
+        config = configuration if configuration else {}
+        self.__filename      = path + os.path.sep + 'chat.log'
+        self.__flushInterval = float(config.get('flushInterval', 1.0))
+        self.__flushSize     = int(config.get('flushSize', 100))
+        self.__rotateSize    = int(config.get('rotateSize', 0))
+        self.__rotateTime    = int(config.get('rotateTime', 0))
+        self.__rotateCount   = int(config.get('rotateCount', 5))
+        self.__queue         = queue.Queue()
+        self.__lockFile      = open(self.__filename + '.lock', 'a')
+        self.__open()
+        self.__thread = threading.Thread(target=self.__loop, daemon=True)
+        self.__thread.start()
+        atexit.register(self.close)             # Write queued records when the engine shuts down
+
+    def __open(self):
+        try:
+            self.__csvfile = open(self.__filename, 'a+')
+        except OSError:
+            raise ValueError(f"Cannot open '{self.__filename}' for writing")
+        self.__inode = os.fstat(self.__csvfile.fileno()).st_ino
+
+    # Reopen the log file when another process rotated it
+    def __reopen(self):
+        try:
+            inode = os.stat(self.__filename).st_ino
+        except FileNotFoundError:
+            inode = None
+        if inode != self.__inode:
+            self.__csvfile.close()
+            self.__open()
+
+    # Queue a log record, it never blocks on file I/O
     def Write(self, msgtype='system', message1='', message2=None, message3=None, message4=None):
-        logline = [datetime.datetime.strftime(datetime.datetime.now(), '%Y/%m/%d %H:%M:%S'), msgtype, message1]
+        logline = [datetime.datetime.now(), msgtype, message1]
         if message2:
             logline += [message2]
         if message3:
             logline += [message3]
         if message4:
             logline += [message4]
-        self.__logFile.writerow(logline)
-        self.__csvfile.flush()
+        self.__queue.put(logline)
+
+    # Background writer, the only one touching the log file so rows never interleave
+    def __loop(self):
+        running = True
+        while running:
+            batch = []
+            deadline = time.monotonic() + self.__flushInterval
+            while len(batch) < self.__flushSize:
+                try:
+                    record = self.__queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if record is None:              # close() request
+                    running = False
+                    break
+                batch.append(record)
+            if len(batch) > 0:
+                self.__write(batch)
+
+    def __write(self, batch):
+        buffer = io.StringIO()
+        logFile = csv.writer(buffer, delimiter='|')
+        for logline in batch:
+            logline[0] = datetime.datetime.strftime(logline[0], '%Y/%m/%d %H:%M:%S')
+            logFile.writerow(logline)
+        fcntl.flock(self.__lockFile, fcntl.LOCK_EX)     # One process at a time writes or rotates
+        try:
+            self.__reopen()
+            self.__csvfile.write(buffer.getvalue())
+            self.__csvfile.flush()
+            self.__rotate()
+        finally:
+            fcntl.flock(self.__lockFile, fcntl.LOCK_UN)
+
+    # Rotate log files when needed: chat.log -> chat.log.1 -> chat.log.2 ... (lock held)
+    def __rotate(self):
+        if not (self.__rotateSize > 0 and os.fstat(self.__csvfile.fileno()).st_size >= self.__rotateSize) and \
+           not (self.__rotateTime > 0 and time.time() - os.fstat(self.__lockFile.fileno()).st_mtime >= self.__rotateTime):
+            return
+        self.__csvfile.close()
+        for index in range(self.__rotateCount-1, 0, -1):
+            if os.path.exists(f'{self.__filename}.{index}'):
+                os.replace(f'{self.__filename}.{index}', f'{self.__filename}.{index+1}')
+        if self.__rotateCount > 0:
+            os.replace(self.__filename, f'{self.__filename}.1')
+        else:
+            os.remove(self.__filename)
+        os.utime(self.__filename + '.lock')     # Rotation time
+        self.__open()
+
+    # Write all queued records and stop the background writer
+    def close(self):
+        if self.__thread.is_alive():
+            self.__queue.put(None)
+            self.__thread.join()
+
+
+# Log writer discarding every record, for offline tools working on a production db/ [import log=log.null()]
+class null():
+    def Write(self, msgtype='system', message1='', message2=None, message3=None, message4=None):
+        pass
+
+    def close(self):
+        pass
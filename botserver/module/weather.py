@@ -4,10 +4,19 @@
 #
 # @return reply(inputList, configuration) -> string with required output
 #
+# Optional configuration keys: [url] OpenWeatherMap API endpoint, [requestTimeout] HTTP timeout (seconds)
 #
 import json
 import requests
 
+CACHE_TTL = 300                             # Temperature is fine for a few minutes, see modules.py
+TIMEOUT   = 10
+URL       = 'https://api.openweathermap.org/data/2.5/weather'
+
+session   = requests.Session()              # Pooled connections, reused across calls
+session.mount('https://', requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=8))
+session.mount('http://',  requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=8))
+
 def reply(inputList=None, config=None):
     if len(inputList) == 0:
         inputList.append('temperature')     # Default command
@@ -27,8 +36,8 @@ def temperature(parameters, config):
             parameters.append(config['units'])
         # Get temp information from remote
         unit = parameters[1].lower() if parameters[1].lower() in ['metric', 'imperial'] else config['units'].lower()
-        url  = f'https://api.openweathermap.org/data/2.5/weather?lat={config["lat"]}&lon={config["lon"]}&appid={config["api"]}&units={unit}'
-        response = requests.get(url)
+        url  = f'{config.get("url", URL)}?lat={config["lat"]}&lon={config["lon"]}&appid={config["api"]}&units={unit}'
+        response = session.get(url, timeout=float(config.get('requestTimeout', 5)))
         data = json.loads(response.text)
         result = str(data['main']['temp'])+'°' + ('F' if unit=='imperial' else 'C')
         return result
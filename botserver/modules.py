@@ -1,38 +1,128 @@
 # -*- coding: utf-8 -*-
 #
 # chat engine modules class
+# @see:
+#       Every module (module/*.py) exposes reply(inputList, configuration) and may declare:
+#           TIMEOUT     (float) seconds before giving up on reply(), default: MODULE_TIMEOUT
+#           CACHE_TTL   (float) seconds a reply is reused for the same parameters, default: 0 (no cache)
+#       both can be overridden from plugin configuration ([timeout], [cacheTTL] keys).
+#       Concurrent calls with the same parameters share the same reply() execution.
+#       A module never takes more than MODULE_BUSY workers, reply() calls still running after their timeout included,
+#       further calls fail until some of them end.
 #
 
 # Program imports
 try:
     import os
     import sys
-    import importlib
+    import time
+    import cache
+    import stats
+    import importlib.util
+    import threading
+    import concurrent.futures
 except ModuleNotFoundError as E:
     print(f"{E}. Install required modules.")
     sys.exit(1)
 
+MODULE_TIMEOUT = 10                             # Default reply() timeout (seconds)
+MODULE_WORKERS = 8                              # Concurrent reply() calls
+MODULE_BUSY    = MODULE_WORKERS // 2            # Concurrent reply() calls of a single module, hung ones included
+MODULE_CACHE   = 256                            # Cached replies for each module
+
 # chat engine log writer [import log=log.writer()]
 class modules():
     # Class constructor/destructor
     def __init__(self, path=None, configuration=None):
         self.__path = path
         self.__config = configuration
-    
-    # Load/Reload active modules
+        self.__executor = concurrent.futures.ThreadPoolExecutor(max_workers=MODULE_WORKERS, thread_name_prefix='module')
+        self.__loaded = {}                      # moduleName -> (module, cache.lruCache()), replaced as a whole by load()
+        self.__running = {}                     # (moduleName, parameters) -> Future, calls in progress not timed out
+        self.__busy = {}                        # moduleName -> reply() calls not ended yet
+        self.__lock = threading.Lock()
+        stats.register(self.__cacheCounters)
+
+    # Load/Reload active modules. Modules are loaded as new module objects and swapped in with a single
+    # assignment, calls already running end their work with the previous ones
     def load(self):
-        for file in os.listdir(self.__path):
+        loaded = {}
+        for file in sorted(os.listdir(self.__path)):
             if file.endswith('.py'):
-                name = 'module.'+file[:-3]
-                globals()[name] = importlib.import_module(name)
-                globals()[name] = importlib.reload(globals()[name])
+                spec = importlib.util.spec_from_file_location('module.'+file[:-3], self.__path + os.path.sep + file)
+                module = importlib.util.module_from_spec(spec)
+                spec.loader.exec_module(module)
+                ttl = float(self.__setting(file[:-3], module, 'cacheTTL', 'CACHE_TTL', 0))
+                loaded[file[:-3]] = (module, cache.lruCache(size=MODULE_CACHE if ttl > 0 else 0, ttl=ttl))
+        self.__loaded = loaded
 
     # Detect if a module is available or not
     # @return (bool) True/False if module is loaded
     def available(self, moduleName):
-        return f'module.{moduleName}' in globals()
+        return moduleName in self.__loaded
 
     # Execute specified module with additional parameters, if any
+    # @raise ValueError(moduleName, errorString) on module errors, timeouts and busy modules
     def execute(self, moduleName, parameters):
+        (module, replyCache) = self.__loaded[moduleName]
+        key = (moduleName, tuple(parameters))
+        result = replyCache.get(key)
+        if result is not None:
+            stats.count('module_calls_total', module=moduleName, result='cached')
+            return result
+        with self.__lock:                       # Coalescing, join a call already in progress
+            future = self.__running.get(key)
+            submitted = future is None
+            if submitted:
+                if self.__busy.get(moduleName, 0) >= MODULE_BUSY:
+                    stats.count('module_calls_total', module=moduleName, result='busy')
+                    raise ValueError(moduleName, f'module [{moduleName}] busy, {MODULE_BUSY} calls still running')
+                future = self.__executor.submit(self.__execute, module, replyCache, key, list(parameters))
+                self.__running[key] = future
+                self.__busy[moduleName] = self.__busy.get(moduleName, 0) + 1
+        if submitted:
+            future.add_done_callback(lambda done: self.__done(key, done))
+        timer = time.perf_counter()
+        try:
+            result = future.result(timeout=float(self.__setting(moduleName, module, 'timeout', 'TIMEOUT', MODULE_TIMEOUT)))
+            stats.count('module_calls_total', module=moduleName, result='ok')
+            return result
+        except concurrent.futures.TimeoutError:
+            with self.__lock:                   # Later calls start a new reply() instead of joining the hung one
+                if self.__running.get(key) is future:
+                    del self.__running[key]
+            stats.count('module_calls_total', module=moduleName, result='timeout')
+            raise ValueError(moduleName, f'module [{moduleName}] timeout')
+        except Exception:
+            stats.count('module_calls_total', module=moduleName, result='error')
+            raise
+        finally:
+            stats.observe('module_seconds', time.perf_counter() - timer, module=moduleName)
+
+    # Executor side of execute()
+    def __execute(self, module, replyCache, key, parameters):
+        moduleName = key[0]
         config = self.__config[moduleName] if moduleName in self.__config else None
-        return globals()['module.'+moduleName].reply(parameters, config)
+        result = module.reply(parameters, config)
+        replyCache.set(key, result)
+        return result
+
+    # [future] reply() call ended, even long after its timeout
+    def __done(self, key, future):
+        with self.__lock:
+            if self.__running.get(key) is future:
+                del self.__running[key]
+            self.__busy[key[0]] -= 1
+
+    # Reply caches counters, see stats.register()
+    def __cacheCounters(self):
+        counterList = []
+        for moduleName, (_, replyCache) in self.__loaded.items():
+            counterList += [('cache_hits_total', {'cache': 'module.'+moduleName}, replyCache.hits), ('cache_misses_total', {'cache': 'module.'+moduleName}, replyCache.misses)]
+        return counterList
+
+    # Module setting from plugin configuration [configKey], module attribute [moduleKey] or [default]
+    def __setting(self, moduleName, module, configKey, moduleKey, default):
+        if moduleName in self.__config and isinstance(self.__config[moduleName], dict) and configKey in self.__config[moduleName]:
+            return self.__config[moduleName][configKey]
+        return getattr(module, moduleKey, default)
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+#
+# Framed botserver protocol (pipelining), used by botserver and its clients
+# @see:
+#       Negotiation, on a plain connection:
+#           > "sys,framed"
+#           < "framed"              Every following message, both ways, is a frame
+#       Frame format:
+#           length (4 bytes, unsigned, network byte order) + payload (UTF-8, [length] bytes)
+#       Payload format:
+#           "id,sys,command"        Request, [id] is any client defined string without commas
+#           "id,msg,username,message"
+#           "id,reply"              Reply to request [id]. Replies may be sent back in a different order
+#
+
+# Program imports
+try:
+    import sys
+    import struct
+except ModuleNotFoundError as E:
+    print(f"{E}. Install required modules.")
+    sys.exit(1)
+
+COMMAND    = 'framed'                           # sys,framed
+HEADER     = struct.Struct('!I')                # Frame length
+FRAME_MAX  = 1048576                            # Max payload size (bytes)
+
+
+# Build a frame for [message] with request [requestId]
+# @return (bytes) frame ready to be sent
+def frame(requestId, message):
+    payload = f"{requestId},{message}".encode('UTF-8')
+    return HEADER.pack(len(payload)) + payload
+
+# Split a frame payload
+# @return (tuple) (requestId, message)
+def unframe(payload):
+    payload = payload.decode('UTF-8').split(',', 1)
+    if len(payload) < 2:
+        raise ValueError('Invalid frame, missing request id')
+    return (payload[0], payload[1])
+
+# Payload size from a frame header
+def length(header):
+    size = HEADER.unpack(header)[0]
+    if size > FRAME_MAX:
+        raise ValueError(f'Frame too large ({size} bytes)')
+    return size
+
+# Receive a whole frame from a blocking socket
+# @return (bytes) frame payload, None when the connection has been closed
+def receive(sock):
+    header = _receiveExactly(sock, HEADER.size)
+    if header is None:
+        return None
+    payload = _receiveExactly(sock, length(header))
+    if payload is None:
+        raise OSError('Connection closed in the middle of a frame')
+    return payload
+
+def _receiveExactly(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+#
+# Micro-batching scheduler, gathers concurrent client messages and sends them to the chat engine with a single call
+# @see:
+#       self.message()      Queue a message and wait for its reply (called from client threads)
+#       chatEngine.messages()
+#
+
+# Program imports
+try:
+    import sys
+    import time
+    import queue
+    import threading
+except ModuleNotFoundError as E:
+    print(f"{E}. Install required modules.")
+    sys.exit(1)
+
+# Batch scheduler [import scheduler=scheduler.batchScheduler()]
+class batchScheduler():
+    # Class constructor
+    # @param engine (chatEngine) Engine used for replies, must implement messages([(username, message)])
+    # @param size   (int)        Max number of messages in a batch
+    # @param wait   (int)        Max time (milliseconds) spent waiting for other messages before dispatching a batch
+    def __init__(self, engine=None, size=16, wait=5):
+        self.__engine = engine
+        self.__size   = size if size > 0 else 1
+        self.__wait   = wait / 1000.0 if wait > 0 else 0
+        self.__queue  = queue.Queue()
+        self.__thread = threading.Thread(target=self.__loop, daemon=True)
+        self.__thread.start()
+
+    # Queue a message for [username] and wait for the reply
+    # @return (String) Replied message, None if message is invalid
+    def message(self, username=None, message=None):
+        request = {'username': username, 'message': message, 'reply': None, 'done': threading.Event()}
+        self.__queue.put(request)
+        request['done'].wait()
+        return request['reply']
+
+    # Dispatcher loop, the first request opens a batch window closed after [wait] ms or [size] requests
+    def __loop(self):
+        while True:
+            batch = [self.__queue.get()]
+            deadline = time.monotonic() + self.__wait
+            while len(batch) < self.__size:
+                timeout = deadline - time.monotonic()
+                try:
+                    batch.append(self.__queue.get(timeout=timeout) if timeout > 0 else self.__queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                replies = self.__engine.messages([(request['username'], request['message']) for request in batch])
+            except Exception:
+                replies = [self.__single(request) for request in batch]  # Batch prediction failed before any reply, one by one
+            for request, reply in zip(batch, replies):
+                request['reply'] = reply
+                request['done'].set()
+
+    # Reply to a single [request] of a failed batch
+    # @return (String) Replied message, error message if this request fails too
+    def __single(self, request):
+        try:
+            return self.__engine.messages([(request['username'], request['message'])])[0]
+        except Exception as E:
+            return f"ERROR: {str(E).strip()}"
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+#
+# Process wide timing histograms and counters
+# @see:
+#       stats.observe()     Add a timing (seconds) to histogram [name] with optional labels
+#       stats.count()       Increment counter [name] with optional labels
+#       stats.register()    Add a callback reporting counters kept elsewhere (caches hits/misses)
+#       stats.snapshot()    Everything as a dictionary (sys,stats)
+#       stats.prometheus()  Everything in Prometheus text exposition format (sys,stats,prometheus)
+#
+#       Labels are keyword arguments: stats.observe('engine_stage_seconds', 0.001, stage='predict')
+#
+
+# Program imports
+try:
+    import os
+    import sys
+    import bisect
+    import threading
+except ModuleNotFoundError as E:
+    print(f"{E}. Install required modules.")
+    sys.exit(1)
+
+PREFIX  = 'botserver_'                          # Prometheus metrics prefix
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Timing histogram, fixed buckets (seconds)
+class histogram():
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)   # Last one: +Inf
+        self.count   = 0
+        self.sum     = 0.0
+
+    def observe(self, seconds):
+        self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum   += seconds
+
+    # @return (float) estimated [q] quantile (0..1), upper bound of the bucket holding it, None above the last bucket (json null)
+    def quantile(self, q):
+        if self.count == 0:
+            return 0.0
+        position = q * self.count
+        total = 0
+        for index, value in enumerate(self.buckets):
+            total += value
+            if total >= position:
+                return BUCKETS[index] if index < len(BUCKETS) else None
+        return None
+
+
+_lock       = threading.Lock()
+_histograms = {}                               # (name, labels) -> histogram()
+_counters   = {}                               # (name, labels) -> int
+_callbacks  = []                               # callback() -> [(name, labels dict, value), ...]
+
+def _key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+# Add a timing (seconds) to [name] histogram
+def observe(name, seconds, **labels):
+    key = _key(name, labels)
+    with _lock:
+        if key not in _histograms:
+            _histograms[key] = histogram()
+        _histograms[key].observe(seconds)
+
+# Increment [name] counter by [value]
+def count(name, value=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+# Register [callback], called on every snapshot to get counters owned by other objects
+def register(callback):
+    with _lock:
+        _callbacks.append(callback)
+
+def _collect():
+    with _lock:
+        histograms = {key: (list(item.buckets), item.count, item.sum, item.quantile(0.5), item.quantile(0.95), item.quantile(0.99))
+                      for key, item in _histograms.items()}
+        counters = dict(_counters)
+        callbacks = list(_callbacks)
+    for callback in callbacks:
+        for (name, labels, value) in callback():
+            counters[_key(name, labels)] = value
+    return (histograms, counters)
+
+def _label(labels):
+    return ','.join(f'{name}={value}' for name, value in labels)
+
+# @return (dict) {'pid': pid, 'histograms': {name: {labels: {count, sum, p50, p95, p99}}}, 'counters': {name: {labels: value}}}
+def snapshot():
+    (histograms, counters) = _collect()
+    result = {'pid': os.getpid(), 'histograms': {}, 'counters': {}}
+    for (name, labels), (_, total, seconds, p50, p95, p99) in sorted(histograms.items()):
+        result['histograms'].setdefault(name, {})[_label(labels)] = {'count': total, 'sum': round(seconds, 6), 'p50': p50, 'p95': p95, 'p99': p99}
+    for (name, labels), value in sorted(counters.items()):
+        result['counters'].setdefault(name, {})[_label(labels)] = value
+    return result
+
+# @return (string) Prometheus text exposition format, every metric with a [pid] label
+def prometheus():
+    (histograms, counters) = _collect()
+    pid = ('pid', str(os.getpid()))
+    lines = []
+    typeList = set()
+    for (name, labels), (buckets, total, seconds, *_) in sorted(histograms.items()):
+        if name not in typeList:
+            lines.append(f'# TYPE {PREFIX}{name} histogram')
+            typeList.add(name)
+        accumulator = 0
+        for index, value in enumerate(buckets):
+            accumulator += value
+            bound = str(BUCKETS[index]) if index < len(BUCKETS) else '+Inf'
+            lines.append(f'{PREFIX}{name}_bucket{_prometheusLabels(labels + (pid, ("le", bound)))} {accumulator}')
+        lines.append(f'{PREFIX}{name}_sum{_prometheusLabels(labels + (pid,))} {seconds}')
+        lines.append(f'{PREFIX}{name}_count{_prometheusLabels(labels + (pid,))} {total}')
+    for (name, labels), value in sorted(counters.items()):
+        if name not in typeList:
+            lines.append(f'# TYPE {PREFIX}{name} counter')
+            typeList.add(name)
+        lines.append(f'{PREFIX}{name}{_prometheusLabels(labels + (pid,))} {value}')
+    return '\n'.join(lines) + '\n'
+
+def _prometheusLabels(labels):
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels) + '}'
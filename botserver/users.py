@@ -1,22 +1,58 @@
 # -*- coding: utf-8 -*-
 #
 # User database class, dealing with user personal data
+# @see:
+#       Storage backends (config.yaml [usersBackend]):
+#           yaml    Whole db/users.yaml loaded in memory, saved on exit (default)
+#           sqlite  db/users.sqlite (WAL mode), one row per user variable read on access and saved with batched write-behind
 #
 
 try:
     # Python imports
     import yaml
+    import json
     import atexit
+    import sqlite3
+    import threading
     # Program imports
     import os
 except ModuleNotFoundError as E:
     print(f"{E}. Install required modules.")
 
+BACKENDS = ['yaml', 'sqlite']
+
+
+# {username: {variable: value}} (users.yaml) -> {(username, variable): value}
+def _flatten(records):
+    return {(username, variable): value for username, record in records.items() if isinstance(record, dict)
+            for variable, value in record.items() if variable != 'username'}
+
+# {(username, variable): value} -> {username: {variable: value}} (users.yaml)
+def _nest(variables):
+    records = {}
+    for (username, variable), value in variables.items():
+        records.setdefault(username, {'username': username})[variable] = value
+    return records
+
+
 # Parsing input arguments
 class database():
     # Class constructor/destructor
-    def __init__(self, path=None):
+    # @param store   (dict)   Shared dictionary returned by share() in another process, nothing is loaded or saved here
+    # @param backend (string) Storage backend [yaml, sqlite]
+    # @param flush   (float)  sqlite only, seconds between two batched writes
+    # @param onError (func)   sqlite only, onError(message) called when a batched write fails (retried on next flush)
+    def __init__(self, path=None, store=None, backend='yaml', flush=1.0, onError=None):
         self.__filename = path + os.path.sep + 'users.yaml'
+        if store is not None:
+            self.__db = store
+            return
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown users backend '{backend}', valid values: {BACKENDS}")
+        if backend == 'sqlite':
+            self.__db = sqliteStore(path + os.path.sep + 'users.sqlite', importFile=self.__filename, flush=flush, onError=onError)
+            atexit.register(self.__db.close)    # Flush pending writes when the engine shuts down
+            return
         if not os.path.exists(self.__filename):
             open(self.__filename, 'a').close()
         if not os.path.isfile(self.__filename):
@@ -26,31 +62,145 @@ class database():
             fHandler.close()
         if not self.__db or self.__db==[] or self.__db=='':
             self.__db = {}
+        self.__db = _flatten(self.__db)         # (username, variable) -> value, see share()
         atexit.register(self.destructor)        # Save volatile data when the engine shuts down
 
     def destructor(self):                       # Don't use __del__(), use this hack instead
         with open(self.__filename, 'w') as fHandler:
-            yaml.dump(self.__db, fHandler)
+            yaml.dump(_nest(dict(self.__db)), fHandler)
 
+    # Flush pending sqlite writes, see chatEngine.close(). yaml users are saved on exit by the process owning them
+    def close(self):
+        if isinstance(self.__db, sqliteStore):
+            self.__db.close()
 
-    # Return user info from database
+    # Move users data into a dictionary shared across processes (multiprocessing.Manager), still saved on exit from here.
+    # One key for each (username, variable), every set() is a single atomic proxy call and workers never overwrite
+    # each other's variables
+    # @return (DictProxy) shared dictionary, used by other processes with database(path, store=...)
+    #         (None)      sqlite backend, every process opens the database file on its own
+    def share(self, manager=None):
+        if isinstance(self.__db, sqliteStore):
+            return None
+        self.__db = manager.dict(self.__db)
+        atexit.unregister(self.destructor)      # Registered again to be saved before the manager shuts down (atexit is LIFO)
+        atexit.register(self.destructor)
+        return self.__db
+
+
+    # Return user info from database, nothing is written for unknown users
     def data(self, Username=None, Variable=None):
         if not Username:
             return None
-        if not Username in self.__db:
-            self.__db[Username] = {'username': Username}
-        if not Variable in self.__db[Username]:
-            return None
-        return self.__db[Username][Variable]
+        value = self.__db.get((Username, Variable))
+        if value is None and Variable == 'username':
+            return Username
+        return value
 
 
     # Set variable=value for [username] or delete it if [None]
     def set(self, Username=None, Variable=None, Value=None):
         if not Username or not Variable:
             return False
-        self.data(Username=Username, Variable=Variable)
-        if Value:
-            self.__db[Username][Variable] = Value
+        if Value:                                   # One key per variable, other variables of the user are not rewritten
+            self.__db[(Username, Variable)] = Value
         else:
-            del(self.__db[Username][Variable])
+            self.__db.pop((Username, Variable), None)
+        return True
+
+
+# sqlite users store, one row per user variable, dictionary like access ((username, variable) -> value) used by database()
+# Nothing is kept in memory except variables still waiting to be written, written in a single transaction every [flush] seconds.
+# Other processes using the same file see changes after the next flush
+class sqliteStore():
+    DELETED = object()                          # Pending variable removal
+
+    def __init__(self, filename=None, importFile=None, flush=1.0, onError=None):
+        self.__flush    = flush if flush > 0 else 1.0
+        self.__onError  = onError if onError else print
+        self.__pending  = {}                    # Variables waiting for the next flush
+        self.__writing  = {}                    # Variables being written right now, still visible to readers
+        self.__lock     = threading.Lock()      # pending/writing dictionaries
+        self.__dbLock   = threading.Lock()      # sqlite connection
+        self.__stop     = threading.Event()
+        isNew = not os.path.exists(filename)
+        self.__connection = sqlite3.connect(filename, check_same_thread=False, isolation_level=None)
+        self.__connection.execute('PRAGMA journal_mode=WAL')
+        self.__connection.execute('PRAGMA synchronous=NORMAL')
+        self.__connection.execute('CREATE TABLE IF NOT EXISTS variables (username TEXT NOT NULL, variable TEXT NOT NULL, value TEXT NOT NULL, '
+                                  'PRIMARY KEY (username, variable))')
+        if isNew and importFile and os.path.isfile(importFile):
+            self.__import(importFile)
+        self.__thread = threading.Thread(target=self.__writer, daemon=True)
+        self.__thread.start()
+
+    # One time migration from the yaml backend
+    def __import(self, filename):
+        with open(filename, 'r') as fHandler:
+            data = yaml.safe_load(fHandler)
+        if isinstance(data, dict) and len(data) > 0:
+            self.__write(_flatten(data))
+
+    def __setitem__(self, key, value):
+        with self.__lock:
+            self.__pending[key] = value
+
+    def pop(self, key, default=None):
+        with self.__lock:
+            self.__pending[key] = self.DELETED
+        return default
+
+    # @param key (tuple) (username, variable)
+    # @return Variable value, [default] if not found (a single query, pending writes first)
+    def get(self, key, default=None):
+        with self.__lock:
+            value = self.__pending.get(key, self.__writing.get(key))
+        if value is self.DELETED:
+            return default
+        if value is not None:
+            return value
+        with self.__dbLock:
+            row = self.__connection.execute('SELECT value FROM variables WHERE username=? AND variable=?', key).fetchone()
+        return json.loads(row[0]) if row else default
+
+    # Write-behind thread
+    def __writer(self):
+        while not self.__stop.wait(self.__flush):
+            self.flush()
+
+    # Write all pending variables in a single transaction, put back for the next flush when it fails
+    def flush(self):
+        with self.__lock:
+            if len(self.__pending) == 0:
+                return
+            self.__writing = self.__pending
+            self.__pending = {}
+        try:
+            self.__write(self.__writing)
+        except sqlite3.Error as E:
+            with self.__lock:
+                self.__pending = {**self.__writing, **self.__pending}     # Variables set meanwhile are newer
+            self.__onError(f"Users database write failed, {len(self.__writing)} variables kept for retry ({str(E).strip()})")
+        finally:
+            with self.__lock:
+                self.__writing = {}
+
+    # Per variable upserts and deletes, concurrent writers only overwrite the same (username, variable)
+    def __write(self, variables):
+        with self.__dbLock:
+            self.__connection.execute('BEGIN')
+            try:
+                self.__connection.executemany('INSERT OR REPLACE INTO variables (username, variable, value) VALUES (?, ?, ?)',
+                                              [(*key, json.dumps(value)) for key, value in variables.items() if value is not self.DELETED])
+                self.__connection.executemany('DELETE FROM variables WHERE username=? AND variable=?',
+                                              [key for key, value in variables.items() if value is self.DELETED])
+                self.__connection.execute('COMMIT')
+            except sqlite3.Error:
+                if self.__connection.in_transaction:
+                    self.__connection.execute('ROLLBACK')
+                raise
 
+    def close(self):
+        self.__stop.set()
+        self.__thread.join()
+        self.flush()